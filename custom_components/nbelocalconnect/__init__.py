@@ -1,11 +1,11 @@
 import asyncio
 import re
 import datetime
-import threading
 import json
 import os
+import time
 from homeassistant.const import CONF_PASSWORD, CONF_SCAN_INTERVAL, EVENT_CORE_CONFIG_UPDATE
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 from homeassistant.exceptions import HomeAssistantError, ConfigEntryNotReady
 from homeassistant.helpers import device_registry as dr
@@ -22,7 +22,7 @@ from homeassistant.components.recorder.statistics import (
     get_last_statistics,
 )
 from datetime import timezone as dt_timezone
-from .const import DOMAIN, NBE_BACKUP_DIR
+from .const import DOMAIN, DEFAULT_REQUEST_WINDOW, DEFAULT_SETTINGS_CACHE_TTL, DEFAULT_BACKUP_MAX_AGE, DEFAULT_BACKUP_WATCH_INTERVAL, DEFAULT_SESSION_KEY
 
 STOKERCLOUD_BASE = "https://www.stokercloud.dk"
 STOKERCLOUD_LOGIN = STOKERCLOUD_BASE + "/v2/dataout2/login.php"
@@ -30,9 +30,47 @@ STOKERCLOUD_CONSUMPTION = STOKERCLOUD_BASE + "/v2/dataout2/getconsumption.php"
 # Boiler states that indicate an alarm condition
 ALARM_STATES = {8, 11, 12, 13, 15, 16, 17, 19, 20, 26, 27, 29, 30, 31, 36, 37, 38, 39, 41, 42, 44, 45}
 ALARM_HISTORY_MAX = 25
+# Snapshot af sidst kendte data gemmes højst så ofte (sekunder)
+SNAPSHOT_SAVE_DELAY = 60
+
+# Poll tiers - operating_data/ og info/ polles hver cycle, de øvrige kun
+# når deres tier er forældet (sekunder). Consumption polles desuden ved
+# hvert timeskift, settings ved opstart, efter en skrivning og ellers sjældent.
+ADVANCED_INTERVAL = 300
+SETTINGS_INTERVAL = 6 * 3600
+
+POLL_CONSUMPTION = [
+    'consumption_data/counter',
+    'consumption_data/total_hours',
+    'consumption_data/total_days',
+    'consumption_data/total_months',
+    'consumption_data/dhw_hours',
+    'consumption_data/dhw_days',
+    'consumption_data/dhw_months',
+]
+POLL_SETTINGS = [
+    'settings/boiler/',
+    'settings/hot_water/',
+    'settings/regulation/',
+    'settings/weather/',
+    'settings/weather2/',
+    'settings/oxygen/',
+    'settings/cleaning/',
+    'settings/hopper/',
+    'settings/fan/',
+    'settings/auger/',
+    'settings/ignition/',
+    'settings/pump/',
+    'settings/sun/',
+    'settings/misc/',
+    'settings/alarm/',
+    'settings/manual/',
+]
 
 from .rtbdata import RTBData
-from .protocol import Proxy
+from .protocol import AsyncProxy, BoilerUnavailable, user_priority
+from .restore import RestoreJob
+from .backup_store import CATALOG_KEY, async_get_catalog
 from logging import getLogger
 
 logger = getLogger(__name__)
@@ -473,6 +511,26 @@ async def async_load_daily_from_db(hass, coordinator):
     coordinator._last_known_day = datetime.datetime.now(tz=tz).day
 
 
+def _get_handshake_store(hass) -> Store:
+    """Shared Store with cached discovery/RSA key per boiler serial."""
+    store = hass.data[DOMAIN].get('handshake_store')
+    if store is None:
+        store = Store(hass, 1, f"{DOMAIN}_handshake")
+        hass.data[DOMAIN]['handshake_store'] = store
+    return store
+
+
+def _poll_tier(path: str) -> str:
+    """Return the poll tier an endpoint belongs to."""
+    if path.startswith('settings/'):
+        return "settings"
+    if path.startswith('consumption_data/'):
+        return "consumption"
+    if path.startswith('advanced_data/'):
+        return "advanced"
+    return "operating"
+
+
 def _clean_statistic_part(value: str) -> str:
     """Make statistic_id part Home Assistant safe."""
     value = value.lower().replace("-", "_")
@@ -527,15 +585,9 @@ async def async_inject_yearly_statistics(hass, entry_id: str, stat_suffix: str,
 def _read_daily_from_rtbdata(rtbdata, key: str) -> float:
     """Læs indeværende dags værdi fra et månedligt array i rtbdata.
     Returnerer 0.0 hvis data ikke er tilgængelig."""
-    raw = rtbdata.get(key)
-    if not raw:
-        return 0.0
-    try:
-        parts = [float(v.strip()) for v in str(raw).split("=")[-1].split(",") if v.strip()]
-        current_d = datetime.datetime.now().day - 1
-        return parts[current_d] if len(parts) > current_d else 0.0
-    except (ValueError, IndexError):
-        return 0.0
+    parts = rtbdata.get_array(key)
+    current_d = datetime.datetime.now().day - 1
+    return parts[current_d] if parts and len(parts) > current_d else 0.0
 
 
 async def async_load_yearly_from_db(hass, coordinator):
@@ -623,24 +675,57 @@ async def async_setup_entry(hass, entry):
     port = entry.data.get('port', 8483)
     serialnumber = entry.data.get('serial', None)
     scan_interval = entry.data.get(CONF_SCAN_INTERVAL, 30)
+    request_window = entry.data.get('request_window', DEFAULT_REQUEST_WINDOW)
+    settings_cache_ttl = entry.data.get('settings_cache_ttl', DEFAULT_SETTINGS_CACHE_TTL)
+    backup_max_age = entry.data.get('backup_max_age', DEFAULT_BACKUP_MAX_AGE)
+    backup_watch_interval = entry.data.get('backup_watch_interval', DEFAULT_BACKUP_WATCH_INTERVAL)
+    session_key = entry.options.get('session_key', entry.data.get('session_key', DEFAULT_SESSION_KEY))
+
+    # Discovery-resultat og RSA nøgle caches pr. serienummer
+    handshake_key = serialnumber or ip_address
+    handshake_store = _get_handshake_store(hass)
+    handshakes = await handshake_store.async_load() or {}
+    cached_handshake = handshakes.get(handshake_key) if handshake_key else None
 
     if serialnumber:
         ip_address = '<broadcast>'
 
     logger.info(f"Creating proxy connection to {ip_address}:{port}...")
     try:
-        proxy = await hass.async_add_executor_job(
-            Proxy,
+        proxy = await AsyncProxy.async_connect(
             password,
             port,
             ip_address,
-            serialnumber
+            serialnumber,
+            request_window,
+            cached=cached_handshake,
+            settings_ttl=settings_cache_ttl,
+            use_session=session_key,
         )
-        logger.info("✅ Proxy connection established!")
+        logger.info(f"✅ Proxy connection established{' (cached handshake)' if cached_handshake else ''}!")
     except Exception as e:
         logger.error(f"❌ Failed to create proxy connection: {e}", exc_info=True)
         raise ConfigEntryNotReady(f"Cannot connect to boiler: {e}") from e
 
+    async def _async_save_handshake(p):
+        data = await handshake_store.async_load() or {}
+        data[handshake_key] = p.handshake_data()
+        await handshake_store.async_save(data)
+
+    try:
+        if handshake_key:
+            proxy.on_handshake = lambda p: hass.async_create_task(_async_save_handshake(p))
+            if not cached_handshake:
+                await _async_save_handshake(proxy)
+        return await _async_setup_boiler(hass, entry, proxy, ip_address, scan_interval, backup_max_age, backup_watch_interval)
+    except BaseException:
+        # Setup fejlede efter forbindelsen blev åbnet - luk socket'en igen
+        proxy.close()
+        raise
+
+
+async def _async_setup_boiler(hass, entry, proxy, ip_address, scan_interval, backup_max_age, backup_watch_interval):
+    """Set up device, coordinator, platforms and services on a connected proxy."""
     # Create device
     device_registry = dr.async_get(hass)
     device_identifier = proxy.serial if hasattr(proxy, 'serial') and proxy.serial else ip_address
@@ -653,16 +738,12 @@ async def async_setup_entry(hass, entry):
         model="Pellet Boiler",
     )
 
-    # threading.Lock — beskytter socketen mod samtidige kald fra coordinator og services
-    proxy_lock = threading.Lock()
-
     # Create coordinator
     coordinator = RTBDataCoordinator(
         hass,
         entry.entry_id,
         proxy,
         scan_interval,
-        proxy_lock,
         device_identifier
     )
 
@@ -671,10 +752,20 @@ async def async_setup_entry(hass, entry):
 
     # Fetch initial data
     await coordinator.async_load_alarm_history()
-    await coordinator.async_config_entry_first_refresh()
+    # Findes et snapshot oprettes entities fra det og markeres stale -
+    # første live poll kører så i baggrunden når setup er færdig
+    first_poll_pending = await coordinator.async_load_snapshot()
+    if not first_poll_pending:
+        await coordinator.async_load_capabilities()
+        await coordinator.async_config_entry_first_refresh()
 
     # Store coordinator
     hass.data[DOMAIN][entry.entry_id + '_coordinator'] = coordinator
+    restore_job = RestoreJob(hass, entry.entry_id, coordinator)
+    # Backup-listen deles af alle entries og holdes i hukommelsen
+    backup_catalog = await async_get_catalog(hass)
+    backup_catalog.async_watch(backup_watch_interval)
+    hass.data[DOMAIN][entry.entry_id + '_restore'] = restore_job
 
     # Setup platforms
     await hass.config_entries.async_forward_entry_setups(entry, ["sensor", "button", "number", "select", "switch"])
@@ -772,7 +863,8 @@ async def async_setup_entry(hass, entry):
 
     # ----------------------------------------------------------------
     # Service: set_setting
-    # Uses same proxy_lock as coordinator - no socket conflicts
+    # AsyncProxy har op til `window` requests i luften ad gangen og fordeler
+    # svarene efter sekvensnummer - skrivningen kan sendes sideløbende med poll'en
     # ----------------------------------------------------------------
     async def handle_set_setting(call):
         """Handle set_setting service call."""
@@ -801,16 +893,22 @@ async def async_setup_entry(hass, entry):
 
         logger.info(f"Setting {key} to {value}")
 
-        def locked_set(k, v):
-            with proxy_lock:
-                return proxy.set(k, v)
-
+        written = False
         try:
-            result = await hass.async_add_executor_job(locked_set, key, str(value))
+            result = await proxy.set(key, str(value))
+            written = True
             logger.info(f"Successfully set {key} = {value}")
         except Exception as e:
             logger.error(f"Error setting {key}: {e}")
             raise
+        finally:
+            if not written:
+                # Skrivningen fejlede - entities slipper deres optimistiske state,
+                # og nøglen læses igen ved næste poll
+                coordinator.mark_stale(key)
+                coordinator.async_notify_keys([key])
+        # Bekræft skrivningen med én genlæsning af nøglen i stedet for fuld poll
+        await coordinator.async_refresh_keys([key])
 
     hass.services.async_register(DOMAIN, "set_setting", handle_set_setting)
 
@@ -821,75 +919,48 @@ async def async_setup_entry(hass, entry):
     # ----------------------------------------------------------------
     async def handle_backup_settings(call):
         """Save all boiler settings to backup file."""
-        timestamp = datetime.datetime.now().strftime("%d-%m-%Y-%H-%M")
-
-        # Find highest backup number and create dir - run in executor
-        def get_next_num_and_makedirs():
-            os.makedirs(NBE_BACKUP_DIR, exist_ok=True)
-            next_num = 1
-            nums = []
-            for fname in os.listdir(NBE_BACKUP_DIR):
-                m = re.match(r'backup(\d+)_', fname)
-                if m:
-                    nums.append(int(m.group(1)))
-            if nums:
-                next_num = max(nums) + 1
-            return next_num
-
-        next_num = await hass.async_add_executor_job(get_next_num_and_makedirs)
-        filename = f"backup{next_num}_{timestamp}.json"
-        filepath = os.path.join(NBE_BACKUP_DIR, filename)
-
-        # Fetch all settings directly from boiler
-        # Use all unique categories from BACKUP_SETTINGS
+        # Værdierne tages fra coordinatorens cache - kun kategorier ældre end
+        # max_age læses igen fra fyret (skrivninger markerer deres kategori stale)
+        max_age = call.data.get("max_age", backup_max_age)
         categories = list(dict.fromkeys(cat for cat, key in BACKUP_SETTINGS))
-
-        def locked_get_all():
-            results = {}
-            with proxy_lock:
-                for category in categories:
-                    try:
-                        data = proxy.get(f"settings/{category}/")
-                        for item in (data or []):
-                            s = str(item)
-                            if "=" in s and s.startswith("settings/"):
-                                path, value = s.rsplit("=", 1)
-                                results[path] = value
-                    except Exception as e:
-                        logger.warning(f"Backup: could not fetch settings/{category}/: {e}")
-            return results
-
-        settings_lookup = await hass.async_add_executor_job(locked_get_all)
-
-        backup_data = {
-            "version": 1,
-            "created": datetime.datetime.now().isoformat(),
-            "name": filename,
-            "settings": {}
-        }
-
+        now = time.time()
+        fresh = set()
+        stale = []
+        for category in categories:
+            last = coordinator.endpoint_refreshed.get(f"settings/{category}/")
+            if last is not None and now - last <= max_age:
+                fresh.add(category)
+            else:
+                stale.append(category)
+        if stale:
+            fresh |= await coordinator.async_read_settings(stale)
+        logger.debug(f"Backup: {len(categories) - len(stale)} categories from cache, re-read {stale}")
+
+        settings = {}
+        # Kun de friske kategorier slås op i RTBData's indeks
+        cached = {}
+        for category in fresh:
+            cached.update(coordinator.rtbdata.get_all_starting_with(f"settings/{category}/"))
         missing = []
         for category, key in BACKUP_SETTINGS:
             path = f"settings/{category}/{key}"
-            if path in settings_lookup:
-                backup_data["settings"][path] = settings_lookup[path]
+            value = cached.get(path)
+            if value is not None:
+                settings[path] = value
             else:
                 missing.append(path)
                 logger.warning(f"Backup: {path} not found in cached data")
 
-        def write_backup():
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(backup_data, f, indent=2, ensure_ascii=False)
-
-        await hass.async_add_executor_job(write_backup)
-        logger.info(f"✅ Backup saved: {filepath} ({len(backup_data['settings'])} settings)")
+        saved = await backup_catalog.async_add(settings, device_identifier)
+        filename = saved["name"]
+        logger.info(f"✅ Backup saved: {filename} ({len(settings)} settings)")
 
         # Update select entity with the new file
         select_key = entry.entry_id + '_backup_select'
         if select_key in hass.data[DOMAIN]:
             await hass.data[DOMAIN][select_key].async_refresh_options()
 
-        msg = f"NBE backup saved: **{filename}**\n{len(backup_data['settings'])} settings saved."
+        msg = f"NBE backup saved: **{filename}**\n{len(settings)} settings saved."
         if missing:
             msg += f"\nℹ️ {len(missing)} settings not available on this boiler."
         await hass.services.async_call("persistent_notification", "create", {"message": msg, "title": "NBE Backup", "notification_id": "nbe_backup"})
@@ -913,80 +984,29 @@ async def async_setup_entry(hass, entry):
             await hass.services.async_call("persistent_notification", "create", {"message": "No backup file selected - please choose a file in the Restore dropdown first.", "title": "NBE Restore", "notification_id": "nbe_restore_error"})
             return
 
-        filepath = os.path.join(NBE_BACKUP_DIR, filename)
-
-        def read_backup():
-            if not os.path.exists(filepath):
-                return None
-            with open(filepath, encoding="utf-8") as f:
-                return json.load(f)
-
-        backup_data = await hass.async_add_executor_job(read_backup)
+        backup_data = await backup_catalog.async_load_backup(filename)
         if backup_data is None:
-            raise HomeAssistantError(f"Backup file not found: {filepath}")
+            raise HomeAssistantError(f"Backup not found: {filename}")
 
         settings = backup_data.get("settings", {})
         if not settings:
             raise HomeAssistantError(f"Backup file contains no settings: {filename}")
 
-        def locked_set(k, v):
-            with proxy_lock:
-                return proxy.set(k, str(v))
+        # Restore kører som et baggrundsjob - servicen returnerer med det samme
+        await restore_job.async_start(filename, settings)
 
-        ok = 0
-        errors = 0
-        total = len(settings)
-
-        # Send start notification
-        await hass.services.async_call("persistent_notification", "create", {
-            "message": f"Restoring **{filename}**...\nThis will take a few minutes. Progress updates every 10 settings.",
-            "title": "NBE Restore",
-            "notification_id": "nbe_restore"
-        })
+    hass.services.async_register(DOMAIN, "restore_settings", handle_restore_settings)
 
-        for path, value in settings.items():
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await hass.async_add_executor_job(locked_set, path, value)
-                    ok += 1
-                    if attempt > 0:
-                        logger.info(f"Restore retry succeeded for {path} (attempt {attempt + 1})")
-                    break
-                except OSError as e:
-                    # Timeout - retry after short pause
-                    if attempt < max_retries - 1:
-                        logger.warning(f"Restore timeout for {path}, retrying ({attempt + 1}/{max_retries - 1})...")
-                        await asyncio.sleep(1)
-                    else:
-                        logger.error(f"Restore error for {path}: {e}")
-                        errors += 1
-                except Exception as e:
-                    # Other errors (index out of range etc) - no point retrying
-                    logger.error(f"Restore error for {path}: {e}")
-                    errors += 1
-                    break
-
-            # Update progress notification every 10 settings
-            if (ok + errors) % 10 == 0:
-                await hass.services.async_call("persistent_notification", "create", {
-                    "message": f"Restoring... {ok + errors} of {total} settings done.",
-                    "title": "NBE Restore",
-                    "notification_id": "nbe_restore"
-                })
-
-        logger.info(f"✅ Restore complete from {filename}: {ok} ok, {errors} errors")
-
-        # Send final notification before coordinator refresh
-        msg = f"NBE restore from **{filename}** complete.\n✅ {ok} settings restored."
-        if errors:
-            msg += f"\n❌ {errors} settings failed - check log."
-        await hass.services.async_call("persistent_notification", "create", {"message": msg, "title": "NBE Restore", "notification_id": "nbe_restore"})
-
-        # Refresh coordinator data
-        await coordinator.async_request_refresh()
+    # ----------------------------------------------------------------
+    # Service: cancel_restore
+    # Stops a running restore - settings already written stay written
+    # ----------------------------------------------------------------
+    async def handle_cancel_restore(call):
+        """Cancel the running restore job."""
+        if not await restore_job.async_cancel():
+            logger.info("Cancel restore: no restore is running")
 
-    hass.services.async_register(DOMAIN, "restore_settings", handle_restore_settings)
+    hass.services.async_register(DOMAIN, "cancel_restore", handle_cancel_restore)
 
     # ----------------------------------------------------------------
     # Service: delete_backup
@@ -1009,16 +1029,9 @@ async def async_setup_entry(hass, entry):
             })
             return
 
-        filepath = os.path.join(NBE_BACKUP_DIR, filename)
-        def check_and_delete():
-            if not os.path.exists(filepath):
-                return False
-            os.remove(filepath)
-            return True
-
-        deleted = await hass.async_add_executor_job(check_and_delete)
+        deleted = await backup_catalog.async_delete(filename)
         if not deleted:
-            raise HomeAssistantError(f"Backup file not found: {filepath}")
+            raise HomeAssistantError(f"Backup not found: {filename}")
         logger.info(f"Deleted backup file: {filename}")
 
         # Refresh select entity
@@ -1087,8 +1100,31 @@ async def async_setup_entry(hass, entry):
 
     hass.services.async_register(DOMAIN, "delete_backup", handle_delete_backup)
 
+    # ----------------------------------------------------------------
+    # Service: probe_endpoints
+    # Tester igen hvilke endpoints fyret understøtter
+    # ----------------------------------------------------------------
+    async def handle_probe_endpoints(call):
+        """Re-run endpoint capability detection."""
+        with user_priority():
+            await coordinator.async_load_capabilities(force=True)
+        await coordinator.async_request_refresh()
+
+    hass.services.async_register(DOMAIN, "probe_endpoints", handle_probe_endpoints)
+
 
 
+    if first_poll_pending:
+        # Startes først her, så delta-logikken ikke kører før yearly/helper2 er loadet
+        async def _async_first_poll():
+            await coordinator.async_load_capabilities()
+            await coordinator.async_refresh()
+
+        hass.async_create_task(_async_first_poll())
+
+    # Genoptag en restore der blev afbrudt af en genstart
+    hass.async_create_task(restore_job.async_resume())
+
     logger.info("NBELocalConnect setup complete!")
     return True
 
@@ -1098,15 +1134,20 @@ async def async_unload_entry(hass, entry):
     unload_ok = await hass.config_entries.async_unload_platforms(entry, ["sensor", "button", "number", "select", "switch"])
 
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id + '_coordinator')
+        coordinator = hass.data[DOMAIN].pop(entry.entry_id + '_coordinator')
+        await hass.data[DOMAIN].pop(entry.entry_id + '_restore').async_shutdown()
+        hass.data[DOMAIN][CATALOG_KEY].async_release()
+        coordinator.proxy.close()
         hass.data[DOMAIN].pop(entry.entry_id + '_backup_select', None)
         hass.data[DOMAIN].pop(entry.entry_id + '_energy_kwh', None)
         hass.data[DOMAIN].pop(entry.entry_id + '_energy_wh', None)
         hass.services.async_remove(DOMAIN, "set_setting")
         hass.services.async_remove(DOMAIN, "backup_settings")
         hass.services.async_remove(DOMAIN, "restore_settings")
+        hass.services.async_remove(DOMAIN, "cancel_restore")
         hass.services.async_remove(DOMAIN, "delete_backup")
         hass.services.async_remove(DOMAIN, "import_stokercloud")
+        hass.services.async_remove(DOMAIN, "probe_endpoints")
 
     return unload_ok
 
@@ -1114,7 +1155,7 @@ async def async_unload_entry(hass, entry):
 class RTBDataCoordinator(DataUpdateCoordinator):
     """Data coordinator der henter ALT fra fyret."""
 
-    def __init__(self, hass, entry_id, proxy, scan_interval, proxy_lock, statistic_identifier):
+    def __init__(self, hass, entry_id, proxy, scan_interval, statistic_identifier):
         """Initialize coordinator."""
         self.hass = hass
         self.entry_id = entry_id
@@ -1124,8 +1165,6 @@ class RTBDataCoordinator(DataUpdateCoordinator):
         self.info_message = 0
         self.info_messages = []
         self.translations = {"boiler_state": {}, "boiler_substate": {}, "boiler_info": {}}
-        self.proxy_lock = proxy_lock
-        self.last_raw_data = []  # Bruges af backup service
         self.stokercloud_pellets = []    # Importeret fra StokerCloud
         self.stokercloud_dhw = []        # Importeret fra StokerCloud
         self.stokercloud_timestamps = [] # Unix ms, nyeste foerst (fra StokerCloud)
@@ -1142,6 +1181,21 @@ class RTBDataCoordinator(DataUpdateCoordinator):
         self._alarm_store = Store(hass, 1, f"{DOMAIN}_alarm_history_{entry_id}")
         self._helper2_store = Store(hass, 1, f"{DOMAIN}_helper2_{entry_id}")
         self._history_store = Store(hass, 1, f"{DOMAIN}_yearly_history_{entry_id}")
+        # Poll tiers: seneste vellykkede læsning (time.time()) pr. tier og endpoint
+        self.tier_refreshed = {"operating": None, "advanced": None, "consumption": None, "settings": None}
+        self.endpoint_refreshed = {}
+        # Capability detection: endpoints fyret svarer med data på (None = ukendt, poll alle)
+        self.supported_endpoints = None
+        self.sw_versions = None
+        self._capability_store = Store(hass, 1, f"{DOMAIN}_capabilities_{entry_id}")
+        # Sidst kendte data - entities oprettes fra den ved opstart (stale indtil første live poll)
+        self._snapshot_store = Store(hass, 1, f"{DOMAIN}_snapshot_{entry_id}")
+        self.stale = False
+        # Nøgle -> callbacks for entities der kun opdateres når deres nøgler ændres
+        self._key_listeners = {}
+        self._unsub_key_polling = None
+        # Nøgler ændret i seneste poll - None betyder "alt" (alle andre opdateringer)
+        self.changed_keys = None
 
         update_interval = datetime.timedelta(seconds=scan_interval)
         super().__init__(hass, logger, name=DOMAIN, update_interval=update_interval)
@@ -1153,6 +1207,81 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             self._alarm_history = data[-ALARM_HISTORY_MAX:]
             logger.debug(f"Loaded {len(self._alarm_history)} alarm history entries")
 
+    async def async_load_snapshot(self) -> bool:
+        """Load the last persisted RTBData snapshot. Returns True if one was loaded."""
+        data = await self._snapshot_store.async_load()
+        if not data or not isinstance(data, dict) or not data.get("data"):
+            return False
+        self.rtbdata.set([f"{key}={value}" for key, value in data["data"].items()])
+        self.stale = True
+        logger.info(f"Loaded snapshot with {len(data['data'])} keys from {data.get('saved')}")
+        return True
+
+    def _snapshot_data(self) -> dict:
+        """Return the snapshot to persist (called by Store on delayed save).
+
+        Only the values are kept: the snapshot just fills entities until the
+        first poll, which reads every endpoint again.
+        """
+        return {
+            "saved": datetime.datetime.now().isoformat(timespec='seconds'),
+            "data": dict(self.rtbdata.get_all()),
+        }
+
+    async def async_load_capabilities(self, force=False):
+        """Load or detect which optional endpoints this boiler answers.
+
+        The probe result is cached keyed by the sw_versions reply, so it is
+        only redone after a firmware change or when forced. Only an endpoint
+        that answers without values is skipped; one whose probe failed keeps
+        being polled, and the result is not cached until every probe answered.
+        """
+        try:
+            versions = await self.proxy.get('sw_versions/')
+        except Exception as e:
+            logger.debug(f"Could not read sw_versions, polling all endpoints: {e}")
+            return
+        fingerprint = ';'.join(sorted(v for v in (versions or []) if v))
+        self.sw_versions = fingerprint
+
+        cached = await self._capability_store.async_load()
+        if not force and isinstance(cached, dict) and cached.get("sw_versions") == fingerprint:
+            self.supported_endpoints = set(cached.get("endpoints", []))
+            logger.debug(f"Loaded {len(self.supported_endpoints)} supported endpoints for firmware {fingerprint}")
+            return
+
+        paths = ['advanced_data/'] + POLL_CONSUMPTION + POLL_SETTINGS
+        logger.info(f"Probing {len(paths)} endpoints for firmware {fingerprint}...")
+        results = await asyncio.gather(*(self.proxy.get_items(path) for path in paths), return_exceptions=True)
+        supported = set()
+        failed = []
+        now = time.time()
+        for path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                # Ukendt - bliv ved med at polle det indtil en probe får svar
+                failed.append(path)
+                supported.add(path)
+                continue
+            prefix, payload = result
+            if any(item.partition('=')[2] != '' for item in payload.split(';')):
+                supported.add(path)
+                # Probesvaret er en gyldig læsning - spar den i første poll
+                self.rtbdata.set_payload(prefix, payload)
+                self.endpoint_refreshed[path] = now
+                self.tier_refreshed[_poll_tier(path)] = now
+        if len(failed) == len(paths):
+            logger.warning("Endpoint probe got no replies - polling all endpoints")
+            return
+
+        self.supported_endpoints = supported
+        skipped = sorted(set(paths) - supported)
+        logger.info(f"Endpoint probe: {len(supported)} supported, skipping {skipped}")
+        if failed:
+            # Gemmes ikke - næste probe (efter genforbindelse eller genstart) prøver dem igen
+            logger.info(f"Endpoint probe got no reply from {failed} - not caching the result")
+            return
+        await self._capability_store.async_save({"sw_versions": fingerprint, "endpoints": sorted(supported)})
+
     async def async_load_helper2(self):
         """Load helper2 values from persistent storage."""
         data = await self._helper2_store.async_load()
@@ -1161,6 +1290,138 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             self._helper2_dhw = data.get("helper2_dhw")
             logger.debug(f"Loaded helper2: pellets={self._helper2_pellets}, dhw={self._helper2_dhw}")
 
+    def _due_endpoints(self, tz) -> list:
+        """Return the endpoints whose poll tier is due this cycle."""
+        now = time.time()
+        hour_start = datetime.datetime.now(tz=tz).replace(minute=0, second=0, microsecond=0).timestamp()
+
+        def stale(path, interval):
+            last = self.endpoint_refreshed.get(path)
+            return last is None or now - last >= interval
+
+        def supported(path):
+            return self.supported_endpoints is None or path in self.supported_endpoints
+
+        due = ['operating_data/']
+        if supported('advanced_data/') and stale('advanced_data/', ADVANCED_INTERVAL):
+            due.append('advanced_data/')
+        for path in POLL_CONSUMPTION:
+            last = self.endpoint_refreshed.get(path)
+            if supported(path) and (last is None or last < hour_start):
+                due.append(path)
+        for path in POLL_SETTINGS:
+            if supported(path) and stale(path, SETTINGS_INTERVAL):
+                due.append(path)
+        # Vejetesten tæller forced_run ned på fyret - læs auger hver cyklus mens den kører
+        if 'settings/auger/' not in due and self.rtbdata.get_int('settings/auger/forced_run', 0) > 0:
+            due.append('settings/auger/')
+        return due
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Update broadcast listeners, then the key listeners of the changed keys.
+
+        A poll's changed_keys only applies to its own update; any other
+        update (translations, imports, restore) reaches every key listener.
+        """
+        super().async_update_listeners()
+        changed = self.changed_keys
+        self.changed_keys = None
+        self.async_notify_keys(list(self._key_listeners) if changed is None else changed)
+
+    def mark_stale(self, key: str):
+        """Force the endpoint holding key to be re-read on the next poll.
+
+        Called after writes so settings are read back even though the
+        settings tier is otherwise only refreshed rarely.
+        """
+        parts = key.strip('/').split('/')
+        if parts[0] == 'settings' and len(parts) >= 2:
+            self.endpoint_refreshed.pop(f"settings/{parts[1]}/", None)
+        elif len(parts) >= 1:
+            self.endpoint_refreshed.pop(f"{parts[0]}/", None)
+
+    @callback
+    def async_add_key_listener(self, keys, update_callback):
+        """Call update_callback when one of keys changes or is re-read.
+
+        Returns a function that removes the listener.
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        if self._unsub_key_polling is None:
+            # Key-entities lytter ikke på coordinatoren - hold poll'en i gang for dem
+            self._unsub_key_polling = self.async_add_listener(lambda: None)
+        for key in keys:
+            self._key_listeners.setdefault(key, []).append(update_callback)
+
+        @callback
+        def remove_listener():
+            for key in keys:
+                listeners = self._key_listeners.get(key, [])
+                if update_callback in listeners:
+                    listeners.remove(update_callback)
+                if not listeners:
+                    self._key_listeners.pop(key, None)
+            if not self._key_listeners and self._unsub_key_polling is not None:
+                self._unsub_key_polling()
+                self._unsub_key_polling = None
+
+        return remove_listener
+
+    async def async_refresh_keys(self, keys) -> list:
+        """Read back single keys and notify only the entities listening to them.
+
+        One request per key (pipelined), instead of a full poll. Keys that
+        could not be read are marked stale so the next poll picks them up.
+        Every listener of keys is called, so pending optimistic states are
+        cleared even when a read back failed. Returns the keys that were
+        refreshed.
+        """
+        keys = list(dict.fromkeys(keys))
+        with user_priority():
+            results = await asyncio.gather(*(self.proxy.get(key) for key in keys), return_exceptions=True)
+        refreshed = []
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception) or not result:
+                logger.debug(f"Read back of {key} failed ({result}) - re-read on next poll")
+                self.mark_stale(key)
+                continue
+            self.rtbdata.set([f"{key}={result[0]}"])
+            refreshed.append(key)
+        self.async_notify_keys(keys)
+        logger.debug(f"Refreshed {refreshed}")
+        return refreshed
+
+    @callback
+    def async_notify_keys(self, keys):
+        """Call the key listeners of keys, each callback once."""
+        notified = set()
+        for key in keys:
+            for update_callback in self._key_listeners.get(key, ()):
+                if update_callback not in notified:
+                    notified.add(update_callback)
+                    update_callback()
+
+    async def async_read_settings(self, categories) -> set:
+        """Read whole settings categories into RTBData at user priority.
+
+        Returns the categories that were read.
+        """
+        categories = list(dict.fromkeys(categories))
+        paths = [f"settings/{category}/" for category in categories]
+        with user_priority():
+            results = await asyncio.gather(*(self.proxy.get_items(path) for path in paths), return_exceptions=True)
+        read = set()
+        now = time.time()
+        for category, path, result in zip(categories, paths, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not read {path}: {result}")
+                continue
+            if self.rtbdata.set_payload(*result):
+                read.add(category)
+                self.endpoint_refreshed[path] = now
+        return read
+
     def get_translated_alarm_history(self) -> list:
         """Return alarm history with translated messages based on current language."""
         result = []
@@ -1175,17 +1436,18 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             })
         return result
 
+    def _unchanged(self):
+        """Result of an update that read nothing: no key listener is called."""
+        self.changed_keys = set()
+        return None
+
     async def _async_update_data(self):
         """Fetch ALLE data fra fyret."""
 
-        # locked_get holder proxy_lock mens get() kører i executor thread
-        def locked_get(path):
-            with self.proxy_lock:
-                return self.proxy.get(path)
-
         try:
             logger.info("Fetching ALL data from boiler...")
-            all_data = []
+            key_count = 0
+            was_stale = self.stale
 
             # ================================================================
             # 1. DAG-SKIFT DETEKTION - FØRST, før poll af consumption data
@@ -1220,93 +1482,67 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             self._last_known_day = _current_day
 
             # ================================================================
-            # 2. OPERATING DATA
+            # CIRCUIT BREAKER - fyret svarer ikke: send kun én billig probe
+            # (med backoff) i stedet for en fuld poll der timer ud
             # ================================================================
-            logger.debug("Fetching operating_data/...")
-            try:
-                data = await self.hass.async_add_executor_job(locked_get, 'operating_data/')
-                if data:
-                    all_data.extend(data)
-                    logger.debug(f"  ✓ Got {len(data)} operating_data items")
-            except Exception as e:
-                logger.debug(f"  ✗ Error fetching operating_data: {e}")
-
-            # ================================================================
-            # 3. ADVANCED DATA
-            # ================================================================
-            logger.debug("Fetching advanced_data/...")
-            try:
-                data = await self.hass.async_add_executor_job(locked_get, 'advanced_data/')
-                if data:
-                    all_data.extend(data)
-                    logger.debug(f"  ✓ Got {len(data)} advanced_data items")
-            except Exception as e:
-                logger.debug(f"  ✗ Error fetching advanced_data: {e}")
-
-            # ================================================================
-            # 4. CONSUMPTION DATA - frisk poll efter dag-skift tjek
-            # ================================================================
-            logger.debug("Fetching consumption_data individually...")
-            for key in [
-                'consumption_data/counter',
-                'consumption_data/total_hours',
-                'consumption_data/total_days',
-                'consumption_data/total_months',
-                'consumption_data/dhw_hours',
-                'consumption_data/dhw_days',
-                'consumption_data/dhw_months',
-            ]:
+            if not self.proxy.breaker.is_closed:
                 try:
-                    data = await self.hass.async_add_executor_job(locked_get, key)
-                    if data:
-                        all_data.extend(data)
-                        logger.debug(f"  ✓ Got {key}")
+                    await self.proxy.get('operating_data/state')
+                    logger.info("Boiler probe answered - resuming full poll")
+                    # Fyret kan have været genstartet efter en firmware-opdatering
+                    await self.async_load_capabilities()
+                except BoilerUnavailable as e:
+                    logger.debug(f"Boiler down, skipping poll: {e}")
+                    return self._unchanged()
+                except TimeoutError:
+                    logger.debug(f"Boiler probe timed out, next probe in {self.proxy.breaker.seconds_to_probe()}s")
+                    # Fyret kan have fået ny IP - prøv discovery igen
+                    try:
+                        await self.proxy.async_rediscover()
+                        logger.info(f"Boiler rediscovered at {self.proxy.addr}")
+                    except Exception as e:
+                        logger.debug(f"Rediscovery failed: {e}")
+                        return self._unchanged()
                 except Exception as e:
-                    logger.debug(f"  ✗ No data for {key}")
+                    # Fx et ugyldigt svar eller lukket socket - breakeren er åbnet igen
+                    logger.debug(f"Boiler probe failed ({e}), next probe in {self.proxy.breaker.seconds_to_probe()}s")
+                    return self._unchanged()
 
             # ================================================================
-            # 5. SETTINGS ENDPOINTS
+            # 2-5. OPERATING, ADVANCED, CONSUMPTION, SETTINGS OG INFO
+            # Alle requests sendes pipelined - proxy fordeler svarene efter
+            # sekvensnummer, så hele poll'en tager få round trips
             # ================================================================
-            for endpoint in [
-                'settings/boiler/',
-                'settings/hot_water/',
-                'settings/regulation/',
-                'settings/weather/',
-                'settings/weather2/',
-                'settings/oxygen/',
-                'settings/cleaning/',
-                'settings/hopper/',
-                'settings/fan/',
-                'settings/auger/',
-                'settings/ignition/',
-                'settings/pump/',
-                'settings/sun/',
-                'settings/misc/',
-                'settings/alarm/',
-                'settings/manual/',
-            ]:
-                logger.debug(f"Fetching {endpoint}...")
-                try:
-                    data = await self.hass.async_add_executor_job(locked_get, endpoint)
-                    if data:
-                        all_data.extend(data)
-                        logger.debug(f"  ✓ Got {len(data)} items from {endpoint}")
-                except Exception as e:
-                    logger.debug(f"  ✗ Error fetching {endpoint}: {e}")
-
-            if all_data:
-                self.rtbdata.set(all_data)
-                self.last_raw_data = all_data  # Store for backup service
-                logger.info(f"✅ Successfully fetched {len(all_data)} total data points!")
+            paths = self._due_endpoints(_tz)
+            logger.debug(f"Fetching {len(paths) + 1} endpoints pipelined: {paths}")
+            results = await asyncio.gather(
+                *(self.proxy.get_items(path) for path in paths),
+                self.proxy.get('info/'),
+                return_exceptions=True,
+            )
+            info_result = results.pop()
+            now = time.time()
+            for path, result in zip(paths, results):
+                if isinstance(result, Exception):
+                    logger.debug(f"  ✗ Error fetching {path}: {result}")
+                    continue
+                # Svaret parses direkte ind i RTBData uden mellemlister
+                count = self.rtbdata.set_payload(*result)
+                if count:
+                    key_count += count
+                    self.endpoint_refreshed[path] = now
+                    self.tier_refreshed[_poll_tier(path)] = now
+                    logger.debug(f"  ✓ Got {count} items from {path}")
+
+            if key_count:
+                self.stale = False
+                self._snapshot_store.async_delay_save(self._snapshot_data, SNAPSHOT_SAVE_DELAY)
+                logger.info(f"✅ Successfully fetched {key_count} total data points!")
             else:
                 logger.warning("Poll returned empty data - keeping last known values")
 
             # Alarm history tracking
-            state_raw = self.rtbdata.get('operating_data/state')
-            try:
-                current_state = int(state_raw) if state_raw else None
-            except (ValueError, TypeError):
-                current_state = None
+            current_state = self.rtbdata.get_int('operating_data/state')
 
             if current_state in ALARM_STATES and current_state != self._last_alarm_state:
                 entry = {
@@ -1329,15 +1565,9 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             # helper2 = helper1
             # ================================================================
             def _read_daily_field(key: str) -> float | None:
-                raw = self.rtbdata.get(key)
-                if not raw:
-                    return None
-                try:
-                    parts = [float(v.strip()) for v in str(raw).split("=")[-1].split(",") if v.strip()]
-                    current_d = datetime.datetime.now(tz=_tz).day - 1
-                    return parts[current_d] if len(parts) > current_d else None
-                except (ValueError, IndexError):
-                    return None
+                parts = self.rtbdata.get_array(key)
+                current_d = datetime.datetime.now(tz=_tz).day - 1
+                return parts[current_d] if parts and len(parts) > current_d else None
 
             if self.stokercloud_pellets and self.stokercloud_timestamps:
                 # Opdater timestamps[0] til indeværende år - håndterer nytår automatisk
@@ -1406,9 +1636,10 @@ class RTBDataCoordinator(DataUpdateCoordinator):
             # ================================================================
             # 5. INFO MESSAGE
             # ================================================================
-            logger.debug("Fetching info/...")
             try:
-                data = await self.hass.async_add_executor_job(locked_get, 'info/')
+                if isinstance(info_result, Exception):
+                    raise info_result
+                data = info_result
                 if data:
                     raw = data[0].strip() if data else '0'
                     parts = [p.strip() for p in raw.split(',') if p.strip()]
@@ -1428,11 +1659,16 @@ class RTBDataCoordinator(DataUpdateCoordinator):
                 self.info_messages = []
                 self.info_message = 0
 
-            return all_data
+            # Entities skriver kun state hvis en af deres nøgler er ændret.
+            # Skifter stale-flaget skal alle opdateres
+            changed = self.rtbdata.take_changed()
+            self.changed_keys = None if self.stale != was_stale else changed
+            logger.debug(f"{len(changed)} keys changed in this poll")
+            return self.rtbdata.get_all()
 
         except TimeoutError:
             logger.debug("Timeout fetching data. Will retry next interval.")
-            return None
+            return self._unchanged()
         except Exception as e:
             logger.error(f"Error fetching data: {e}")
-            return None
\ No newline at end of file
+            return self._unchanged()
\ No newline at end of file
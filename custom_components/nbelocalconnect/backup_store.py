@@ -0,0 +1,296 @@
+"""NBELocalConnect - Settings backup store.
+
+Backups are kept as one index file plus content-addressed, gzip compressed
+payloads:
+
+    nbe_backup/index.json                  name, created, serial, hash, count
+    nbe_backup/objects/<sha256>.json.gz    the settings {path: value}
+
+Identical settings share one payload, and listing backups reads only the
+index. BackupStore does blocking file I/O and runs in the executor;
+BackupCatalog keeps the index in memory for all config entries.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import timedelta
+from logging import getLogger
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .const import DOMAIN, NBE_BACKUP_DIR
+
+_LOGGER = getLogger(__name__)
+
+INDEX_FILE = "index.json"
+OBJECTS_DIR = "objects"
+LEGACY_DIR = "legacy"
+INDEX_VERSION = 1
+CATALOG_KEY = "backup_catalog"
+
+# One lock for all store instances - several boilers can share the directory
+_LOCK = threading.Lock()
+
+
+def _canonical(settings: dict) -> bytes:
+    return json.dumps(settings, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class BackupStore:
+    """Index and payload files of the settings backups in one directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.objects_path = os.path.join(directory, OBJECTS_DIR)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, f"{digest}.json.gz")
+
+    def _read_index(self) -> list:
+        if not os.path.exists(self.index_path):
+            if not os.path.isdir(self.directory):
+                return []
+            return self._migrate()
+        with open(self.index_path, encoding="utf-8") as f:
+            return json.load(f).get("backups", [])
+
+    def _write_index(self, backups: list):
+        os.makedirs(self.directory, exist_ok=True)
+        data = {"version": INDEX_VERSION, "backups": backups}
+        _write_atomic(self.index_path, json.dumps(data, indent=1, ensure_ascii=False).encode("utf-8"))
+
+    def _write_object(self, settings: dict) -> str:
+        """Store settings once under their content hash; returns the hash."""
+        raw = _canonical(settings)
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self.objects_path, exist_ok=True)
+            _write_atomic(path, gzip.compress(raw, mtime=0))
+        return digest
+
+    def _migrate(self) -> list:
+        """Import the .json files of older versions into the store.
+
+        Only runs while there is no index. The old files are moved to
+        legacy/ afterwards, so nothing is deleted.
+        """
+        backups = []
+        legacy = [f for f in os.listdir(self.directory) if f.endswith('.json')]
+        for fname in legacy:
+            path = os.path.join(self.directory, fname)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                settings = data.get("settings", {})
+                created = data.get("created") or datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+            except (OSError, ValueError, AttributeError) as e:
+                _LOGGER.warning(f"Backup migration: skipping {fname}: {e}")
+                continue
+            backups.append({
+                "name": fname,
+                "created": created,
+                "serial": data.get("serial"),
+                "hash": self._write_object(settings),
+                "count": len(settings),
+            })
+        backups.sort(key=lambda b: b["created"], reverse=True)
+        self._write_index(backups)
+        if legacy:
+            os.makedirs(os.path.join(self.directory, LEGACY_DIR), exist_ok=True)
+            for fname in legacy:
+                shutil.move(os.path.join(self.directory, fname), os.path.join(self.directory, LEGACY_DIR, fname))
+            _LOGGER.info(f"Migrated {len(backups)} backup files to {self.index_path}")
+        return backups
+
+    def entries(self) -> list:
+        """Return the index entries, newest first."""
+        with _LOCK:
+            return self._read_index()
+
+    def add(self, settings: dict, serial=None) -> dict:
+        """Store a new backup and return its index entry."""
+        with _LOCK:
+            backups = self._read_index()
+            nums = [int(m.group(1)) for m in (re.match(r'backup(\d+)_', b["name"]) for b in backups) if m]
+            now = datetime.datetime.now()
+            entry = {
+                "name": f"backup{max(nums, default=0) + 1}_{now.strftime('%d-%m-%Y-%H-%M')}",
+                "created": now.isoformat(),
+                "serial": serial,
+                "hash": self._write_object(settings),
+                "count": len(settings),
+            }
+            duplicate = any(b["hash"] == entry["hash"] for b in backups)
+            backups.insert(0, entry)
+            self._write_index(backups)
+        if duplicate:
+            _LOGGER.debug(f"Backup {entry['name']} has the same settings as an earlier backup - payload shared")
+        return entry
+
+    def load(self, name: str):
+        """Return the backup as {"name", "created", "serial", "settings"}, or None.
+
+        None is also returned when the payload file has gone missing.
+        """
+        with _LOCK:
+            entry = next((b for b in self._read_index() if b["name"] == name), None)
+            if entry is None:
+                return None
+            try:
+                with gzip.open(self._object_path(entry["hash"]), "rb") as f:
+                    settings = json.loads(f.read())
+            except FileNotFoundError:
+                _LOGGER.warning(f"Backup {name}: payload {entry['hash']} is missing")
+                return None
+        return {
+            "version": 1,
+            "name": entry["name"],
+            "created": entry["created"],
+            "serial": entry.get("serial"),
+            "settings": settings,
+        }
+
+    def delete(self, name: str) -> bool:
+        """Remove a backup; its payload goes when no other backup shares it."""
+        with _LOCK:
+            backups = self._read_index()
+            entry = next((b for b in backups if b["name"] == name), None)
+            if entry is None:
+                return False
+            backups.remove(entry)
+            self._write_index(backups)
+            if not any(b["hash"] == entry["hash"] for b in backups):
+                try:
+                    os.remove(self._object_path(entry["hash"]))
+                except FileNotFoundError:
+                    pass
+        return True
+
+
+class BackupCatalog:
+    """In-memory list of the backups, shared by all config entries.
+
+    Updated by the backup services through async_add/async_delete, so
+    readers never touch the disk. A watcher optionally checks the index
+    mtime to pick up changes made outside Home Assistant.
+    """
+
+    def __init__(self, hass, store):
+        self.hass = hass
+        self.store = store
+        self.entries = []
+        self.names = []
+        self._mtime = None
+        self._listeners = []
+        self._users = 0
+        self._unsub_watch = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.store.index_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _load_sync(self):
+        entries = self.store.entries()
+        return entries, self._stat()
+
+    def _add_sync(self, settings, serial):
+        saved = self.store.add(settings, serial)
+        return saved, self._load_sync()
+
+    def _delete_sync(self, name):
+        deleted = self.store.delete(name)
+        return deleted, self._load_sync()
+
+    @callback
+    def _set(self, loaded):
+        self.entries, self._mtime = loaded
+        self.names = [backup["name"] for backup in self.entries]
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    async def async_load(self):
+        try:
+            loaded = await self.hass.async_add_executor_job(self._load_sync)
+        except (OSError, ValueError, AttributeError) as e:
+            # Et ødelagt indeks må ikke stoppe integrationen - listen er blot tom
+            _LOGGER.error(f"Could not read backup index {self.store.index_path}: {e}")
+            return
+        self._set(loaded)
+
+    async def async_add(self, settings: dict, serial=None) -> dict:
+        """Store a new backup and return its index entry."""
+        saved, loaded = await self.hass.async_add_executor_job(self._add_sync, settings, serial)
+        self._set(loaded)
+        return saved
+
+    async def async_delete(self, name: str) -> bool:
+        deleted, loaded = await self.hass.async_add_executor_job(self._delete_sync, name)
+        self._set(loaded)
+        return deleted
+
+    async def async_load_backup(self, name: str):
+        return await self.hass.async_add_executor_job(self.store.load, name)
+
+    @callback
+    def async_add_listener(self, update_callback):
+        """Call update_callback when the list changes; returns a function that removes it."""
+        self._listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            if update_callback in self._listeners:
+                self._listeners.remove(update_callback)
+
+        return remove_listener
+
+    async def _async_check(self, now=None):
+        # Kun en stat af indekset - listen læses kun når den er ændret
+        mtime = await self.hass.async_add_executor_job(self._stat)
+        if mtime != self._mtime:
+            _LOGGER.debug("Backup index changed on disk - reloading")
+            await self.async_load()
+
+    @callback
+    def async_watch(self, interval: int):
+        """Check the index for outside changes every interval seconds."""
+        if interval and self._unsub_watch is None:
+            self._unsub_watch = async_track_time_interval(self.hass, self._async_check, timedelta(seconds=interval))
+
+    @callback
+    def async_release(self):
+        """Drop one user; the last one removes the catalog."""
+        self._users -= 1
+        if self._users > 0:
+            return
+        if self._unsub_watch is not None:
+            self._unsub_watch()
+            self._unsub_watch = None
+        self.hass.data[DOMAIN].pop(CATALOG_KEY, None)
+
+
+async def async_get_catalog(hass) -> BackupCatalog:
+    """Return the shared backup catalog, loading it on first use."""
+    catalog = hass.data[DOMAIN].get(CATALOG_KEY)
+    if catalog is None:
+        catalog = BackupCatalog(hass, BackupStore(NBE_BACKUP_DIR))
+        hass.data[DOMAIN][CATALOG_KEY] = catalog
+        await catalog.async_load()
+    catalog._users += 1
+    return catalog
@@ -3,9 +3,7 @@ from homeassistant.helpers.entity import Entity
 from homeassistant.components.button import ButtonEntity
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from .const import DOMAIN
-from .protocol import Proxy
 from logging import getLogger
-import asyncio
 
 _LOGGER = getLogger(__name__)
 
@@ -20,6 +18,7 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
         RTBSignalButton(coordinator, proxy, "Reset Boiler Alarm", "settings/misc/reset_alarm", f"{entry_id}_nbereset", "1"),
         NBEBackupButton(coordinator, hass, f"{entry_id}_nbe_backup"),
         NBERestoreButton(coordinator, hass, f"{entry_id}_nbe_restore"),
+        NBECancelRestoreButton(coordinator, hass, f"{entry_id}_nbe_cancel_restore"),
         NBEDeleteBackupButton(coordinator, hass, f"{entry_id}_nbe_delete_backup"),
         NBEResetEnergyButton(coordinator, hass, f"{entry_id}_nbe_reset_energy"),
         RTBSignalButton(coordinator, proxy, "Reset Ignitions", "settings/ignition/clear_ignitions", f"{entry_id}_nbe_clear_ignitions", "1"),
@@ -53,17 +52,13 @@ class RTBSignalButton(CoordinatorEntity, ButtonEntity):
 
     async def async_press(self) -> None:
         _LOGGER.debug(f"Pressing {self._name}...")
-        def _do_set():
-            with self.coordinator.proxy_lock:
-                self.proxy.set(self._path, self._value)
         try:
-            await self.hass.async_add_executor_job(_do_set)
+            await self.proxy.set(self._path, self._value)
             _LOGGER.debug(f"Successfully pressed {self._name}")
         except Exception as e:
             _LOGGER.error(f"Error pressing {self._name}: {e}")
             raise
-        await asyncio.sleep(3)
-        await self.coordinator.async_request_refresh()
+        await self.coordinator.async_refresh_keys([self._path])
 
 
 class NBEBackupButton(CoordinatorEntity, ButtonEntity):
@@ -121,6 +116,33 @@ class NBERestoreButton(CoordinatorEntity, ButtonEntity):
     async def async_press(self) -> None:
         await self._hass.services.async_call(DOMAIN, "restore_settings", {})
 
+class NBECancelRestoreButton(CoordinatorEntity, ButtonEntity):
+    """Button that stops a running settings restore."""
+
+    def __init__(self, coordinator, hass, uid):
+        super().__init__(coordinator)
+        self._hass = hass
+        self.uid = uid
+
+    @property
+    def name(self):
+        return "Cancel Restore"
+
+    @property
+    def unique_id(self):
+        return self.uid
+
+    @property
+    def device_info(self):
+        return {"identifiers": {(DOMAIN, self.coordinator.entry_id)}}
+
+    @property
+    def icon(self):
+        return "mdi:cancel"
+
+    async def async_press(self) -> None:
+        await self._hass.services.async_call(DOMAIN, "cancel_restore", {})
+
 class NBEDeleteBackupButton(CoordinatorEntity, ButtonEntity):
     """Button that deletes the selected backup file."""
 
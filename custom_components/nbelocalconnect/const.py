@@ -1,4 +1,15 @@
 DOMAIN = "nbelocalconnect"
 PLATFORMS = ['sensor', 'button', 'number', 'select']
  
-NBE_BACKUP_DIR = "/config/nbe_backup"
\ No newline at end of file
+NBE_BACKUP_DIR = "/config/nbe_backup"
+
+# Max requests in flight to the controller at once (sequence numbers 1-99)
+DEFAULT_REQUEST_WINDOW = 4
+# Seconds settings reads may be answered from the proxy cache (0 = off)
+DEFAULT_SETTINGS_CACHE_TTL = 2
+# Max age in seconds of cached settings a backup may use before re-reading them
+DEFAULT_BACKUP_MAX_AGE = 900
+# Seconds between checks of the backup index for outside changes (0 = off)
+DEFAULT_BACKUP_WATCH_INTERVAL = 300
+# Negotiate an XTEA session key for writes (off: not all controllers answer it)
+DEFAULT_SESSION_KEY = False
@@ -0,0 +1,22 @@
+"""NBELocalConnect - Base class for entities bound to RTBData keys."""
+from homeassistant.helpers.update_coordinator import BaseCoordinatorEntity, CoordinatorEntity
+
+
+class RTBKeyEntity(CoordinatorEntity):
+    """Coordinator entity that is only updated when one of its keys changes.
+
+    Instead of the coordinator's broadcast listener the entity registers
+    subscribed_keys with the coordinator's key dispatcher, so a poll only
+    wakes the entities whose keys changed.
+    """
+
+    @property
+    def subscribed_keys(self):
+        return (self.client_key,)
+
+    async def async_added_to_hass(self):
+        # Skips BaseCoordinatorEntity, which would add the broadcast listener
+        await super(BaseCoordinatorEntity, self).async_added_to_hass()
+        self.async_on_remove(
+            self.coordinator.async_add_key_listener(self.subscribed_keys, self._handle_coordinator_update)
+        )
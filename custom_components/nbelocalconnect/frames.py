@@ -3,7 +3,9 @@
 from __future__ import print_function
 import time
 import random
-from random import SystemRandom
+import struct
+from collections import namedtuple
+from os import urandom
 import logging
 
 
@@ -13,6 +15,58 @@ START = b'\x02'
 END = b'\x04'
 STATUS_CODES = (0,1,2,3)
 FUNCTION_CODES = (0,1,2,3,4,5,6,7,8,9,10,11)
+# A leading zero byte shortens the RSA ciphertext (about 1 in 256 frames);
+# re-pad and retry this many times before giving up
+RSA_ATTEMPTS = 8
+
+# Zero padded ascii numbers for the fixed width header fields
+DIGITS2 = [b'%02d' % n for n in range(100)]
+DIGITS3 = [b'%03d' % n for n in range(1000)]
+NO_PIN = b'0000000000'
+_timestamp_cache = [None, b'']
+
+
+def _timestamp():
+    """The header timestamp field, formatted once per second."""
+    now = int(time.time())
+    if _timestamp_cache[0] != now:
+        _timestamp_cache[0] = now
+        _timestamp_cache[1] = ('%10s'%now).encode('ascii')
+    return _timestamp_cache[1]
+
+
+class XTEA(object):
+    """XTEA block cipher (ECB, big endian) for session key encrypted frames."""
+    DELTA = 0x9E3779B9
+    MASK = 0xFFFFFFFF
+
+    def __init__(self, key, cycles=32):
+        if len(key) != 16:
+            raise ValueError("XTEA key must be 16 bytes")
+        k = struct.unpack('>4L', key)
+        # The round keys only depend on the key, so work them out once
+        self.schedule = []
+        s = 0
+        for i in range(cycles):
+            k0 = (s + k[s & 3]) & self.MASK
+            s = (s + self.DELTA) & self.MASK
+            k1 = (s + k[(s >> 11) & 3]) & self.MASK
+            self.schedule.append((k0, k1))
+
+    def encrypt(self, data):
+        if len(data) % 8:
+            raise ValueError("XTEA data must be a multiple of 8 bytes")
+        mask = self.MASK
+        schedule = self.schedule
+        out = bytearray()
+        for i in range(0, len(data), 8):
+            v0, v1 = struct.unpack_from('>2L', data, i)
+            for k0, k1 in schedule:
+                v0 = (v0 + ((((v1 << 4) ^ (v1 >> 5)) + v1) ^ k0)) & mask
+                v1 = (v1 + ((((v0 << 4) ^ (v0 >> 5)) + v0) ^ k1)) & mask
+            out += struct.pack('>2L', v0, v1)
+        return bytes(out)
+
 
 class Request_frame(object):
     def __init__(self):
@@ -26,60 +80,77 @@ class Request_frame(object):
         self.payload = ''
         self.payloadsize = len(self.payload)
         self.function = 0
+        # encode() caches; frames copied per request share them
+        self._prefixes = {}
+        self._pins = {}
 
     def encode(self):
-        while True:
-            success = True
-            self.framedata = ('%12s'%self.appid[:12]).encode('ascii')
-            self.framedata += ('%06d'%int(self.controllerid[:6])).encode('ascii')
-
-            if self.encrypted:
-                if hasattr(self, 'xtea_key'):
-                    self.framedata += ('%1s'%'-').encode('ascii')
-                else:
-                    self.framedata += ('%1s'%'*').encode('ascii')
+        if self.function not in FUNCTION_CODES:
+            raise IOError
+        try:
+            payload = self.payload.encode('ascii')
+        except AttributeError:
+            payload = self.payload
+        if len(payload) > 495:
+            raise IOError
+        # Only seqno, function, pin, timestamp and payload vary per frame;
+        # everything else comes precomputed and is joined in one go
+        h = b''.join((
+            START,
+            DIGITS2[self.function],
+            DIGITS2[self.sequencenumber],
+            self._pin() if self.encrypted else NO_PIN,
+            _timestamp(),
+            b'pad ', #future use
+            DIGITS3[len(payload)], #payload length
+            payload,
+            END,
+        ))
+        if self.encrypted:
+            if hasattr(self, 'xtea_key'):
+                # Session frames: pad to at least 64 bytes and a whole number of blocks
+                padlength = 64 - len(h) if len(h) < 64 else -len(h) % 8
+                h = self.xtea_key.encrypt(h + self._pad(padlength))
             else:
-                self.framedata += ('%1s'%' ').encode('ascii')
+                h = self.rsaencrypt(h)
+        self.framedata = self._prefix() + h
+        return self.framedata
 
-            h = START;
-            if self.function not in FUNCTION_CODES:
-                raise IOError
-            h += ('%02u'%self.function).encode('ascii')
-            h += ('%02d'%self.sequencenumber).encode('ascii')
+    def _prefix(self):
+        """appid, controller id and encryption flag, built once per combination."""
+        if self.encrypted:
+            flag = '-' if hasattr(self, 'xtea_key') else '*'
+        else:
+            flag = ' '
+        key = (self.appid, self.controllerid, flag)
+        try:
+            return self._prefixes[key]
+        except KeyError:
+            prefix = (('%12s'%self.appid[:12]) + ('%06d'%int(self.controllerid[:6])) + flag).encode('ascii')
+            self._prefixes[key] = prefix
+            return prefix
 
-            if self.encrypted:
-                h += ('%10s'%self.pincode[:10]).encode('ascii')
-            else:
-                h += '0000000000'.encode('ascii')
-
-            h += ('%10s'%int(time.time())).encode('ascii')
-            h += ('%4s'%'pad ').encode('ascii') #future use
-            h += ('%03u'%len(self.payload)).encode('ascii') #payload length
-            if len(self.payload) > 495:
-                raise IOError
-            try:
-                h += self.payload.encode('ascii')
-            except UnicodeError:
-                h += self.payload
-            h += END;
-            if self.encrypted: 
-                pad = b''.join([bytes(chr(SystemRandom().randrange(128)), 'utf-8') for x in range(64-len(h))])
-                #print(f"padlength: {len(pad)}")
-                h+=pad
-                if hasattr(self, 'xtea_key'):
-                    #print ('xtea encrypt 2')
-                    h = self.xtea_key.encrypt(h)
-                else:
-                    #encrypteddata = self.public_key.encrypt(h, None)[0]
-                    h = self.compatencrypt(h)
-                    if len(h) != 64:
-                        success = False
-            self.framedata += h
-            if success:
-                return self.framedata
-            print ('ERROR chipertext wrong length', len(h))
-    
+    def _pin(self):
+        try:
+            return self._pins[self.pincode]
+        except KeyError:
+            pin = ('%10s'%self.pincode[:10]).encode('ascii')
+            self._pins[self.pincode] = pin
+            return pin
 
+    @staticmethod
+    def _pad(length):
+        # Random 7 bit padding in one urandom call
+        return bytes(b & 0x7f for b in urandom(max(length, 0)))
+
+    def rsaencrypt(self, h):
+        """RSA encrypt a padded frame body, re-padding until the ciphertext is 64 bytes."""
+        padlength = 64 - len(h)
+        for attempt in range(RSA_ATTEMPTS):
+            ciphertext = self.compatencrypt(h + self._pad(padlength))
+            if len(ciphertext) == 64:
+                return ciphertext
+        raise IOError(f"RSA ciphertext wrong length ({len(ciphertext)}) after {RSA_ATTEMPTS} attempts")
 
     #RSA textbook encryption
     def compatencrypt(self, message):
@@ -127,6 +198,54 @@ class Request_frame(object):
         if not record[i] == END[0]:
             raise IOError
 
+def parse_payload(payload):
+    d = {}
+    for item in payload.split(';'):
+        name, value = item.split('=')
+        d[name] = value
+    return d
+
+
+# appid and controller id (skipped), START, function, seqno, status, size
+REPLY_HEADER = struct.Struct('18xc2s2sc3s')
+
+
+class Reply(namedtuple('_Reply', 'function sequencenumber status size payload framedata')):
+    """A decoded controller response; a new, read-only one per request."""
+    __slots__ = ()
+    HEADER_SIZE = 28
+
+    @classmethod
+    def decode(cls, record, sequencenumber=None):
+        """Parse and check the 28 byte header, payload and END in one pass.
+
+        Raises IOError for a malformed or truncated frame, or one whose seqno
+        is not `sequencenumber`.
+        """
+        try:
+            start, function, seqno, status, size = REPLY_HEADER.unpack_from(record)
+            if start != START:
+                raise ValueError
+            function = int(function)
+            seqno = int(seqno)
+            status = int(status)
+            size = int(size)
+        except (ValueError, struct.error):
+            raise IOError("Invalid response header")
+        if sequencenumber is not None and seqno != sequencenumber:
+            raise IOError(f"Response seqno {seqno} does not match request {sequencenumber}")
+        end = 27 + size
+        if len(record) < end:
+            raise IOError(f"Truncated response ({len(record)} bytes, payload {size})")
+        # Like before, a missing END or trailing bytes are logged but tolerated
+        if len(record) != end + 1 or record[end] != END[0]:
+            logger.debug(f"Invalid response length {len(record)} or END for payload {size}")
+        return tuple.__new__(cls, (function, seqno, status, size, record[27:end].decode('utf-8', errors='ignore'), record))
+
+    def parse_payload(self):
+        return parse_payload(self.payload)
+
+
 class Response_frame(object):
     def __init__(self, request):
         self.RESPONSE_HEADER_SIZE = 28
@@ -151,44 +270,17 @@ class Response_frame(object):
         return self.framedata
 
     def decode(self, record):
-        self.framedata = record
-        i = 0
-        self.appid = record[i:i+12]
-        i+=12
-        self.controllerid = record[i:i+6]
-        i+=6
-        #import pdb;pdb.set_trace()i
-        if not record[i] == START[0]:
-            raise IOError
-        if len(record) < self.RESPONSE_HEADER_SIZE:
-            raise IOError
-        i += 1
-        self.function = int(record[i:i+2])
-        i += 2
-        self.sequencenumber = int(record[i:i+2])
-        if self.sequencenumber != self.request.sequencenumber:
-            raise IOError
-        i += 2
-        self.status = int(record[i:i+1])
-        i += 1
-        self.size = int(record[i:i+3])
-        i += 3
-        if not len(record) == self.size + self.RESPONSE_HEADER_SIZE:
-            print(f"Invalid response lenght {len(record)}")
-            #raise IOError
-        #print record[i:i+self.size]
-        self.payload = (record[i:i+self.size]).decode('utf-8', errors='ignore')
-        #print self.payload
-        i += self.size
-        if not record[i] == END[0]:
-            print(f"Invalid response END")
-           # raise IOError
+        reply = Reply.decode(record, self.request.sequencenumber)
+        self.framedata = reply.framedata
+        self.appid = record[:12]
+        self.controllerid = record[12:18]
+        self.function = reply.function
+        self.sequencenumber = reply.sequencenumber
+        self.status = reply.status
+        self.size = reply.size
+        self.payload = reply.payload
+        return reply
 
     def parse_payload(self):
-        frame = self.payload
-        d = {}
-        for item in frame.split(';'):
-            name, value = item.split('=')
-            d[name] = value
-        return d
+        return parse_payload(self.payload)
 
@@ -5,6 +5,7 @@ from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.restore_state import RestoreEntity
 from .const import DOMAIN
+from .entity import RTBKeyEntity
 from logging import getLogger
 
 _LOGGER = getLogger(__name__)
@@ -149,15 +150,12 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     )
 
     # --- Dynamic settings number entities ---
-    all_keys = coordinator.rtbdata.get_all_keys()
+    settings_keys = coordinator.rtbdata.get_keys('settings')
 
     # Skip timer/day data and vacuum
     skip_days = {'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday', 'allweek'}
 
-    for key in all_keys:
-        if not key.startswith('settings/'):
-            continue
-
+    for key in settings_keys:
         # Skip timer/day data
         if any(day in key for day in skip_days):
             continue
@@ -171,11 +169,8 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
             continue
 
         # Numeric values only
-        raw = coordinator.rtbdata.get(key)
-        try:
-            float(raw)
-        except (TypeError, ValueError):
-            _LOGGER.debug(f"Skipping non-numeric setting: {key} = {raw}")
+        if coordinator.rtbdata.get_float(key) is None:
+            _LOGGER.debug(f"Skipping non-numeric setting: {key} = {coordinator.rtbdata.get(key)}")
             continue
 
         # Name: "Boiler Temp", "Ignition Max Time" etc.
@@ -195,7 +190,7 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
         _LOGGER.debug(f"Created settings number: {name} ({key})")
 
     _LOGGER.info(f"✓ Total number entities created: {len(entities)}")
-    async_add_entities(entities, True)
+    async_add_entities(entities)
 
 
 # =============================================================================
@@ -275,7 +270,7 @@ class RTBScanIntervalNumber(CoordinatorEntity, NumberEntity, RestoreEntity):
 # SETTINGS NUMBER
 # =============================================================================
 
-class RTBSettingsNumber(CoordinatorEntity, NumberEntity):
+class RTBSettingsNumber(RTBKeyEntity, NumberEntity):
     """Number entity for a writable boiler setting."""
 
     def __init__(self, coordinator, hass, name, client_key, uid, unit, min_val, max_val, step):
@@ -299,11 +294,7 @@ class RTBSettingsNumber(CoordinatorEntity, NumberEntity):
 
     @property
     def native_value(self):
-        raw = self.coordinator.rtbdata.get(self.client_key)
-        try:
-            return float(raw)
-        except (TypeError, ValueError):
-            return None
+        return self.coordinator.rtbdata.get_float(self.client_key)
 
     @property
     def native_min_value(self):
@@ -343,6 +334,7 @@ class RTBSettingsNumber(CoordinatorEntity, NumberEntity):
         return {
             "datapoint_path": self.client_key,
             "writable": True,
+            "stale": self.coordinator.stale,
         }
 
     @property
@@ -1,13 +1,17 @@
 #! /usr/bin/python
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import asyncio
+import contextlib
+import contextvars
+import copy
+import itertools
 import socket
-import select
 from random import randrange
 import time
 from Crypto.PublicKey import RSA
 import base64
-from .frames import Request_frame, Response_frame
+from .frames import Request_frame, Reply, XTEA
 from os import urandom
 from random import SystemRandom, randrange
 #import xtea
@@ -15,13 +19,319 @@ import logging
 
 _LOGGER = logging.getLogger(__name__)
 
-class Proxy:
+READ_TIMEOUT = 7
+WRITE_TIMEOUT = 5
+# Requests AsyncProxy keeps in flight at once. Sequence numbers run 1-99,
+# so the window can never exceed that.
+DEFAULT_WINDOW = 4
+MAX_WINDOW = 98
+# Circuit breaker: consecutive timeouts before the boiler is marked down,
+# and the probe backoff range (seconds) while it is down.
+BREAKER_THRESHOLD = 3
+BREAKER_MIN_BACKOFF = 10
+BREAKER_MAX_BACKOFF = 300
+
+# Retransmission: RTO bounds (seconds) and max resends per request
+RTO_INITIAL = 1.0
+RTO_MIN = 0.2
+RTO_MAX = READ_TIMEOUT
+MAX_RETRANSMITS = 3
+
+# Session key for writes: 16 characters, kept short enough that the
+# "misc.xtea_key=..." write still fits one 64 byte RSA block
+SESSION_KEY_LENGTH = 16
+SESSION_KEY_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+# Seconds a settings read may be answered from cache (0 = off)
+SETTINGS_TTL = 2
+
+# Request priorities (lower goes first): writes, user initiated reads and
+# background polling. A waiting request is passed over at most
+# FAIRNESS_LIMIT times in a row before it is let through anyway.
+PRIORITY_CONTROL = 0
+PRIORITY_USER = 1
+PRIORITY_POLL = 2
+PRIORITY_NAMES = {PRIORITY_CONTROL: 'control', PRIORITY_USER: 'user', PRIORITY_POLL: 'poll'}
+FAIRNESS_LIMIT = 4
+
+# Priority of reads made in the current task; see user_priority()
+request_priority = contextvars.ContextVar('nbe_request_priority', default=PRIORITY_POLL)
+
+
+@contextlib.contextmanager
+def user_priority():
+    """Run proxy reads made inside the block at user priority."""
+    token = request_priority.set(PRIORITY_USER)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class RttEstimator:
+    """Smoothed round trip time and retransmission timeout (RFC 6298)."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RTO_INITIAL
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN), RTO_MAX)
+
+
+class BoilerUnavailable(IOError):
+    """Raised without contacting the boiler while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fail-fast guard for an unreachable boiler.
+
+    After `threshold` consecutive timeouts the breaker opens and requests are
+    refused locally. Once the backoff has passed a single probe request is let
+    through (half open); a reply closes the breaker, another timeout reopens
+    it with the backoff doubled. A probe that ends any other way (bad reply,
+    closed transport, cancellation) reopens it with the same backoff.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, min_backoff=BREAKER_MIN_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.threshold = threshold
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = min_backoff
+        self.opened_at = None
+        self.next_probe = None
+
+    @property
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    def allow(self):
+        """Return True if a request may be sent to the boiler now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() >= self.next_probe:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            _LOGGER.info("Boiler answering again - resuming normal polling")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.min_backoff
+        self.opened_at = None
+        self.next_probe = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self._open()
+        elif self.state == self.CLOSED and self.failures >= self.threshold:
+            _LOGGER.warning(f"Boiler not answering after {self.failures} timeouts - marking it down")
+            self.opened_at = time.time()
+            self._open()
+
+    def abort_probe(self):
+        """The half open probe ended without a reply or a timeout - try again later."""
+        if self.state == self.HALF_OPEN:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.next_probe = time.monotonic() + self.backoff
+
+    def seconds_to_probe(self):
+        if self.next_probe is None:
+            return 0
+        return max(0, round(self.next_probe - time.monotonic()))
+
+class RequestScheduler:
+    """Priority gate in front of the in-flight window.
+
+    When a slot frees up it goes to the highest priority waiter, so writes
+    and user reads overtake queued poll requests. Control requests may use
+    one slot beyond the window and are sent at once. A waiter that has been
+    passed over FAIRNESS_LIMIT times in a row goes next, so polling is never
+    starved.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.active = 0
+        # Waiters: [priority holder, arrival order, future, enqueued at]. The
+        # holder is a one item list so a coalesced read can be promoted.
+        self._queue = []
+        self._order = itertools.count()
+        self._passed = 0
+        self.max_depth = 0
+        # priority -> [requests, total wait, max wait] (seconds)
+        self.waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def _limit(self, priority):
+        return self.window + 1 if priority == PRIORITY_CONTROL else self.window
+
+    async def acquire(self, holder):
+        loop = asyncio.get_running_loop()
+        if not self._queue and self.active < self._limit(holder[0]):
+            self.active += 1
+            self._record(holder[0], 0.0)
+            return
+        entry = [holder, next(self._order), loop.create_future(), loop.time()]
+        self._queue.append(entry)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        # A control request may fit the reserved slot even with a queue
+        self._grant()
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry in self._queue:
+                self._queue.remove(entry)
+            elif not entry[2].cancelled():
+                # Granted just as we were cancelled - hand the slot on
+                self.release()
+            raise
+        self._record(holder[0], loop.time() - entry[3])
+
+    def release(self):
+        self.active -= 1
+        self._grant()
+
+    def _grant(self):
+        while self._queue:
+            best = min(self._queue, key=lambda e: (e[0][0], e[1]))
+            oldest = min(self._queue, key=lambda e: e[1])
+            entry = best
+            # The overdue waiter goes next once it fits the window; until then
+            # a control request may still take the reserved slot
+            if best is not oldest and self._passed >= FAIRNESS_LIMIT and self.active < self._limit(oldest[0][0]):
+                entry = oldest
+            if entry[2].done():
+                # Cancelled waiter its task has not cleaned up yet
+                self._queue.remove(entry)
+                continue
+            if self.active >= self._limit(entry[0][0]):
+                return
+            self._queue.remove(entry)
+            self._passed = self._passed + 1 if entry is not oldest else 0
+            self.active += 1
+            entry[2].set_result(None)
+
+    def _record(self, priority, wait):
+        stats = self.waits[priority]
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+
+
+class BaseProxy:
     root = ('settings', 'operating_data', 'advanced_data', 'consumption_data', 'event_log','sw_versions','info')
     settings = ('boiler', 'hot_water', 'regulation', 'weather', 'weather2', 'oxygen', 'cleaning', 'hopper', 'fan', 'auger', 'ignition', 'pump', 
         'sun', 'vacuum', 'misc', 'alarm', 'manual')
     consumption_data = ('total_hours', 'total_days', 'total_months', 'total_years', 'dhw_hours', 'dhw_days', 'dhw_months', 'dhw_years', 'counter')
 
+    def route(self, d=None):
+        """Map a get path to (function, payload, parse).
+
+        function is None when the path is answered locally; parse is then
+        the result itself instead of a callable taking the reply payload.
+        """
+        d = d.rstrip('/').split('/')
+        if d[0] == None or d[0] == '*':
+            return None, None, [p + '/' for p in self.root]
+        elif d[0] == 'settings':
+            if len(d) == 1:
+                return None, None, ['settings/%s/'%s for s in self.settings]
+            elif d[1] in self.settings:
+                if len(d) == 2:
+                    return 1, d[1] + '.*', lambda p: ['settings/%s/%s'%(d[1], s) for s in p.split(';')]
+                else:
+                    return 1, d[1] + '.' + d[2], lambda p: self._value(p, 1)
+            else:
+                return None, None, []
+        elif d[0] in ('operating_data', 'advanced_data'):
+            if d[0] == 'operating_data':
+                f = 4
+            else:
+                f = 5
+            if len(d) == 1:
+                return f, '*', lambda p: [d[0] + '/' + s for s in p.split(';')]
+            elif len(d) == 2:
+                return f, d[1], lambda p: self._value(p)
+        elif d[0] == 'consumption_data':
+            if len(d) == 1:
+                return None, None, [d[0] + '/' + s for s in self.consumption_data]
+            elif d[1] in self.consumption_data:
+                return 6, d[1], lambda p: [d[0] + '/' + s for s in p.split(';')]
+            else:
+                return None, None, []
+        elif d[0] == 'sw_versions':
+            if len(d) == 1:
+                return 10, '', lambda p: [s for s in p.split(';')]
+            else:
+                return None, None, []
+        elif d[0] == 'info':
+            if len(d) == 1:
+                return 9, '', lambda p: [s for s in p.split(';')]
+            else:
+                return None, None, []
+        elif d[0] == 'event_log':
+            if len(d) == 1:
+                now = time.strftime('%y%m%d:%H%M%S;',time.localtime())
+                return 8, now, lambda p: p.split(';')
+            else:
+                return 8, d[1], lambda p: p.split(';')
+        return None, None, None
+
+    def items_prefix(self, d):
+        """Key prefix for an endpoint that replies with key=value items, else None."""
+        d = d.rstrip('/').split('/')
+        if d[0] in ('operating_data', 'advanced_data') and len(d) == 1:
+            return d[0] + '/'
+        elif d[0] == 'consumption_data' and len(d) == 2 and d[1] in self.consumption_data:
+            return d[0] + '/'
+        elif d[0] == 'settings' and len(d) == 2 and d[1] in self.settings:
+            return 'settings/%s/'%d[1]
+        return None
+
+    @staticmethod
+    def _value(payload, maxsplit=-1):
+        try:
+            return (payload.split('=', maxsplit)[1],)
+        except IndexError:
+            return (payload,)
+
+    def _set_args(self, path, value):
+        """Return the function 2 payload for a settings write, or None."""
+        d = path.rstrip('/').split('/')
+        if len(d) == 3 and d[1] in self.settings and value is not None :
+            return '.'.join(d[1:3]) + '=' + value
+        return None
+
+
+class Proxy(BaseProxy):
     def __init__(self, password, port=8483, addr=None, serialnumber=None):
+        self.stale_replies = 0
         self.password = password
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         for p in range(port+1, 9999):
@@ -37,20 +347,18 @@ class Proxy:
         s.settimeout(7)
         self.s = s
         request = Request_frame()
-        self.response = Response_frame(request)
 
         request.function = 0
         request.payload = 'NBE Discovery'
         if serialnumber:
             request.controllerid = serialnumber
-        request.sequencenumber = randrange(0,100)
+        request.sequencenumber = randrange(1,100)
         self.s.sendto(request.encode() , (addr, port))
-        data, server = self.s.recvfrom(4096)
+        response, server = self._receive(request.sequencenumber, request.function)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 0)
         self.addr = server
 
-        self.response.decode(data)
-        res = self.response.parse_payload()
+        res = response.parse_payload()
         if 'Serial' in res:
             self.serial = res['Serial']
         if 'IP' in res:
@@ -58,12 +366,11 @@ class Proxy:
 
         request.payload = 'misc.rsa_key'
         request.function = 1
-        request.sequencenumber += 1
+        request.sequencenumber = (request.sequencenumber % 99) + 1
         self.s.sendto(request.encode() , self.addr)
-        data, server = self.s.recvfrom(4096)
-        self.response.decode(data)
+        response, server = self._receive(request.sequencenumber, request.function)
         try:
-            key = self.response.payload.split('rsa_key=')[1]
+            key = response.payload.split('rsa_key=')[1]
             key = base64.b64decode(key)
             request.public_key = RSA.importKey(key)
         except IOError: #Exception as e:
@@ -72,74 +379,20 @@ class Proxy:
         self.request = request
 
     def get(self, d=None):
-        d = d.rstrip('/').split('/')
-        if d[0] == None or d[0] == '*':
-            return [p + '/' for p in self.root]
-        elif d[0] == 'settings':
-            if len(d) == 1:
-                return ['settings/%s/'%s for s in self.settings]
-            elif d[1] in self.settings:
-                if len(d) == 2:
-                    response = self.make_request(1, d[1] + '.*')
-                    return ['settings/%s/%s'%(d[1], s) for s in response.payload.split(';')]
-                else:
-                    response = self.make_request(1, d[1] + '.' + d[2])
-                    try:
-                        return (response.payload.split('=', 1)[1],)
-                    except IndexError:
-                        return (response.payload,)
-            else:
-                return []
-        elif d[0] in ('operating_data', 'advanced_data'):
-            if d[0] == 'operating_data':
-                f = 4
-            else:
-                f = 5
-            if len(d) == 1:
-                response = self.make_request(f, '*')
-                return [d[0] + '/' + s for s in response.payload.split(';')]
-            elif len(d) == 2:
-                response = self.make_request(f, d[1])
-                try:
-                    return (response.payload.split('=')[1],)
-                except IndexError:
-                    return (response.payload,)
-        elif d[0] == 'consumption_data':
-            if len(d) == 1:
-                return [d[0] + '/' + s for s in self.consumption_data]
-            elif d[1] in self.consumption_data:
-                response = self.make_request(6, d[1])
-                return [d[0] + '/' + s for s in response.payload.split(';')]
-            else:
-                return []
-        elif d[0] == 'sw_versions':
-            if len(d) == 1:
-                response = self.make_request(10, '')
-                return [s for s in response.payload.split(';')]
-            else:
-                return []
-        elif d[0] == 'info':
-            if len(d) == 1:
-                response = self.make_request(9, '')
-                return [s for s in response.payload.split(';')]
-            else:
-                return []
-        elif d[0] == 'event_log':
-            if len(d) == 1:
-                now = time.strftime('%y%m%d:%H%M%S;',time.localtime())
-                response = self.make_request(8, now)
-                return response.payload.split(';')
-            else:
-                response = self.make_request(8, d[1])
-                return response.payload.split(';')
+        function, payload, parse = self.route(d)
+        if function is None:
+            return parse
+        response = self.make_request(function, payload)
+        return parse(response.payload)
 
     def set(self, path=None, value=None):
         d = path.rstrip('/').split('/')
         if d[0] == None or d[0] == '*':
             return ('settings',)
-        elif len(d) == 3 and d[1] in self.settings and value is not None :
+        payload = self._set_args(path, value)
+        if payload is not None:
             self.s.settimeout(5)
-            response = self.make_request(2, '.'.join(d[1:3]) + '=' + value, encrypt=True)
+            response = self.make_request(2, payload, encrypt=True)
             self.s.settimeout(5.3)
             if response.status == 0:
                 return ('OK',)
@@ -160,23 +413,36 @@ class Proxy:
         self.request.encrypted = encrypt
         self.request.pincode = self.password
         _LOGGER.debug(f"Making request to boiler. encrypt={encrypt}, Seqno={self.request.sequencenumber}, pw={self.request.pincode}")
-        # Check if there's data available to be read without blocking
-        ready_to_read, _, _ = select.select([self.s], [], [], 0)
+        self.s.sendto(self.request.encode(), self.addr)
+        response, server = self._receive(self.request.sequencenumber, function)
+        return response
 
-        if self.s in ready_to_read:
-            # Read and discard any existing data
-            try:
-                while True:
-                    dataDiscard, serverDiscard = self.s.recvfrom(4096)
-                    if not dataDiscard:
-                        break
-            except socket.error:
-                pass  # No more data to receive
+    def _receive(self, sequencenumber, function):
+        """Receive until the reply to `sequencenumber` arrives.
 
-        self.s.sendto(self.request.encode(), self.addr)
-        data, server = self.s.recvfrom(4096)
-        self.response.decode(data)
-        return self.response
+        Returns (reply, server). Late replies to earlier requests (other
+        seqno or function) are counted and dropped; socket.timeout is raised
+        if the socket timeout runs out.
+        """
+        timeout = self.s.gettimeout()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                data, server = self.s.recvfrom(4096)
+                try:
+                    reply = Reply.decode(data, sequencenumber)
+                    if reply.function == function:
+                        return reply, server
+                except IOError:
+                    pass
+                self.stale_replies += 1
+                _LOGGER.debug(f"Dropped stale reply while waiting for seqno {sequencenumber}")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout('timed out')
+                self.s.settimeout(remaining)
+        finally:
+            self.s.settimeout(timeout)
 
     def __enter__(self):
         return self
@@ -184,6 +450,418 @@ class Proxy:
     def __exit__(self, password, port=8483, addr=None, serialnumber=None):
         self.s.close()
 
+class AsyncProxy(BaseProxy, asyncio.DatagramProtocol):
+    """asyncio counterpart of Proxy.
+
+    get, set and make_request are coroutines with the same semantics as the
+    Proxy methods. Requests are pipelined: up to `window` frames can be in
+    flight at once, and each reply datagram is routed to its waiter by
+    sequence number.
+    """
+
+    def __init__(self, password, window=DEFAULT_WINDOW, settings_ttl=SETTINGS_TTL, use_session=False):
+        self.password = password
+        self.transport = None
+        self.addr = None
+        self.timeout = READ_TIMEOUT
+        self.request = Request_frame()
+        self.scheduler = RequestScheduler(max(1, min(window, MAX_WINDOW)))
+        self._pending = {}
+        self.breaker = CircuitBreaker()
+        self.rtt = RttEstimator()
+        self.requests = 0
+        self.retransmits = 0
+        self.losses = 0
+        self.stale_replies = 0
+        # Single flight: (function, payload) -> task of the read in flight
+        self._inflight = {}
+        self.coalesced = 0
+        # Settings read cache: payload -> (expiry, reply), dropped on writes
+        self.settings_ttl = settings_ttl
+        self._settings_cache = {}
+        self._settings_generation = 0
+        self.cache_hits = 0
+        self.from_cache = False
+        self.on_handshake = None
+        self._connect_args = (8483, None, None)
+        # Opt-in: writes use an XTEA session key once negotiated; cleared if
+        # the controller turns it down or does not answer
+        self.use_session = use_session
+        self._session_lock = asyncio.Lock()
+
+    @classmethod
+    async def async_connect(cls, password, port=8483, addr=None, serialnumber=None, window=DEFAULT_WINDOW, cached=None, settings_ttl=SETTINGS_TTL, use_session=False):
+        """Open the UDP endpoint, discover the controller and fetch its RSA key.
+
+        With `cached` (a dict from handshake_data()) the discovery and key
+        exchange are skipped and the proxy talks to the cached address
+        straight away; async_rediscover() redoes them if that goes stale.
+        """
+        loop = asyncio.get_running_loop()
+        proxy = cls(password, window, settings_ttl, use_session)
+        proxy._connect_args = (port, addr, serialnumber)
+        for p in range(port+1, 9999):
+            try:
+                await loop.create_datagram_endpoint(
+                    lambda: proxy,
+                    local_addr=('0.0.0.0', p),
+                    allow_broadcast=True,
+                )
+                break
+            except OSError:
+                if p == 9998:
+                    raise
+        try:
+            if cached:
+                proxy._load_handshake(cached, serialnumber)
+            else:
+                proxy.request.sequencenumber = randrange(1,100)
+                await proxy._async_handshake(port, addr, serialnumber)
+        except BaseException:
+            proxy.close()
+            raise
+        return proxy
+
+    @classmethod
+    async def async_discover(cls, password, port, serialnumber, window=DEFAULT_WINDOW):
+        return await cls.async_connect(password, port, addr='<broadcast>', serialnumber=serialnumber, window=window)
+
+    def handshake_data(self):
+        """Return discovery and key exchange results for caching."""
+        key = self.request.public_key
+        return {
+            "addr": list(self.addr),
+            "serial": getattr(self, 'serial', None),
+            "ip": getattr(self, 'ip', None),
+            "n": key.n if key is not None else None,
+            "e": key.e if key is not None else None,
+        }
+
+    def _load_handshake(self, cached, serialnumber):
+        self.addr = tuple(cached["addr"])
+        if cached.get("serial"):
+            self.serial = cached["serial"]
+        if cached.get("ip"):
+            self.ip = cached["ip"]
+        if serialnumber:
+            self.request.controllerid = serialnumber
+        self.request.sequencenumber = randrange(1,100)
+        if cached.get("n") and cached.get("e"):
+            self.request.public_key = RSA.construct((cached["n"], cached["e"]))
+        else:
+            self.request.public_key = None
+        self.request.pincode = self.password
+        self.from_cache = True
+
+    async def async_rediscover(self):
+        """Redo discovery and key exchange, e.g. after the cached address went stale."""
+        port, addr, serialnumber = self._connect_args
+        await self._async_handshake(port, addr, serialnumber)
+        self.breaker.record_success()
+
+    async def _async_handshake(self, port, addr, serialnumber):
+        if serialnumber:
+            self.request.controllerid = serialnumber
+        # Takes a slot and seqnos like any other request, so a rediscovery
+        # never collides with reads already in flight
+        await self.scheduler.acquire([PRIORITY_CONTROL])
+        try:
+            request = copy.copy(self.request)
+            request.function = 0
+            request.payload = 'NBE Discovery'
+            request.sequencenumber = self._next_sequencenumber()
+            response, server = await self._async_send(request, (addr, port), self.timeout)
+            self.addr = server
+
+            res = response.parse_payload()
+            if 'Serial' in res:
+                self.serial = res['Serial']
+            if 'IP' in res:
+                self.ip = res['IP']
+
+            request.payload = 'misc.rsa_key'
+            request.function = 1
+            request.sequencenumber = self._next_sequencenumber()
+            response, server = await self._async_send(request, self.addr, self.timeout)
+        finally:
+            self.scheduler.release()
+        request = self.request
+        try:
+            key = response.payload.split('rsa_key=')[1]
+            key = base64.b64decode(key)
+            request.public_key = RSA.importKey(key)
+        except IOError: #Exception as e:
+            request.public_key = None
+        request.pincode = self.password
+        self.from_cache = False
+        # A new handshake means a new (or rebooted) controller - renegotiate
+        self._drop_session()
+        if self.on_handshake is not None:
+            self.on_handshake(self)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        # Route on the sequence number in the response header. Late replies
+        # whose request already gave up, duplicates of a retransmitted reply
+        # and replies to a reused seqno with another function are counted
+        # and dropped; the waiter keeps waiting for its own reply.
+        try:
+            function = int(data[19:21])
+            seq = int(data[21:23])
+        except ValueError:
+            self.stale_replies += 1
+            return
+        waiter = self._pending.get(seq)
+        if waiter is None or waiter[0].done() or waiter[1] != function:
+            self.stale_replies += 1
+            _LOGGER.debug(f"Dropped stale reply seqno {seq} function {function}")
+            return
+        waiter[0].set_result((data, addr))
+
+    def error_received(self, exc):
+        _LOGGER.debug(f"UDP error from boiler: {exc}")
+
+    def connection_lost(self, exc):
+        for future, function in self._pending.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError('Transport closed'))
+
+    def _next_sequencenumber(self):
+        """Advance to the next sequence number (1-99) not already in flight."""
+        seq = self.request.sequencenumber
+        while True:
+            seq = (seq % 99) + 1
+            if seq not in self._pending:
+                self.request.sequencenumber = seq
+                return seq
+
+    async def _async_send(self, request, addr, timeout):
+        """Send request and wait for the reply carrying its sequence number.
+
+        The frame is retransmitted unchanged (same seqno) when the RTO
+        expires, doubling the wait each time, up to MAX_RETRANSMITS times
+        within `timeout`. A reply to any copy completes the request.
+
+        Writes (function 2) are not idempotent and their acknowledgement can
+        be slow, so they are sent once and waited on for at least
+        WRITE_TIMEOUT.
+        """
+        loop = asyncio.get_running_loop()
+        seq = request.sequencenumber
+        future = loop.create_future()
+        self._pending[seq] = (future, request.function)
+        frame = request.encode()
+        start = loop.time()
+        write = request.function == 2
+        deadline = start + (max(timeout, WRITE_TIMEOUT) if write else timeout)
+        retransmits = 0
+        self.requests += 1
+        try:
+            while True:
+                self.transport.sendto(frame, addr)
+                wait = deadline - loop.time()
+                if not write:
+                    wait = min(self.rtt.rto * 2 ** retransmits, wait)
+                try:
+                    data, server = await asyncio.wait_for(asyncio.shield(future), wait)
+                    break
+                except TimeoutError:
+                    if write or retransmits >= MAX_RETRANSMITS or loop.time() >= deadline:
+                        self.losses += 1
+                        raise
+                    retransmits += 1
+                    self.retransmits += 1
+                    _LOGGER.debug(f"No reply to seqno {seq}, retransmitting ({retransmits}/{MAX_RETRANSMITS})")
+        finally:
+            if self._pending.get(seq, (None,))[0] is future:
+                del self._pending[seq]
+            future.cancel()
+        # Karn: only requests answered without retransmission give a valid
+        # sample. Write acknowledgements wait for the controller to store the
+        # value and would inflate the read RTO.
+        if not retransmits and not write:
+            self.rtt.sample(loop.time() - start)
+        return Reply.decode(data, request.sequencenumber), server
+
+    async def get(self, d=None):
+        function, payload, parse = self.route(d)
+        if function is None:
+            return parse
+        response = await self.make_request(function, payload)
+        return parse(response.payload)
+
+    async def get_items(self, d):
+        """Read a key=value endpoint; returns (key prefix, raw payload) for RTBData.set_payload."""
+        prefix = self.items_prefix(d)
+        if prefix is None:
+            raise ValueError(f"{d} does not reply with key=value items")
+        function, payload, parse = self.route(d)
+        response = await self.make_request(function, payload)
+        return prefix, response.payload
+
+    async def set(self, path=None, value=None):
+        d = path.rstrip('/').split('/')
+        if d[0] == None or d[0] == '*':
+            return ('settings',)
+        payload = self._set_args(path, value)
+        if payload is not None:
+            self._invalidate_settings(payload)
+            session = False
+            try:
+                if self.use_session and not self.session_active:
+                    await self._async_start_session()
+                session = self.session_active
+                response = await self.make_request(2, payload, encrypt=True, timeout=WRITE_TIMEOUT)
+            except TimeoutError:
+                # A controller that cannot decrypt the frame cannot read its seqno
+                # either, so a key problem shows up as a timeout. A reply with a
+                # non-zero status is an ordinary rejection (out of range etc).
+                if not session and not self.from_cache:
+                    raise
+                response = None
+            if response is None and session:
+                # Retry with RSA; if that is answered the session key was the problem
+                _LOGGER.info("Session key write not answered - falling back to RSA")
+                self._drop_session()
+                try:
+                    response = await self.make_request(2, payload, encrypt=True, timeout=WRITE_TIMEOUT)
+                    self.use_session = False
+                except TimeoutError:
+                    if not self.from_cache:
+                        raise
+            if response is None:
+                # The cached RSA key may be outdated - re-handshake and retry once
+                _LOGGER.info("Encrypted write not answered - redoing handshake")
+                await self.async_rediscover()
+                response = await self.make_request(2, payload, encrypt=True, timeout=WRITE_TIMEOUT)
+            # Reads that started while the write was in flight may hold the old value
+            self._invalidate_settings(payload)
+            if response.status == 0:
+                return ('OK',)
+            else:
+                return (response.payload,)
+        else:
+            return await self.get(path)
+
+    def _invalidate_settings(self, payload):
+        """Forget cached and in-flight reads of the setting a write payload changes."""
+        self._settings_generation += 1
+        category, key = payload.split('=', 1)[0].split('.', 1)
+        for read in (category + '.*', category + '.' + key):
+            self._settings_cache.pop(read, None)
+            self._inflight.pop((1, read), None)
+
+    @property
+    def session_active(self):
+        return hasattr(self.request, 'xtea_key')
+
+    def _drop_session(self):
+        """Forget the session key; True if there was one."""
+        if hasattr(self.request, 'xtea_key'):
+            del self.request.xtea_key
+            return True
+        return False
+
+    async def _async_start_session(self):
+        """Send a random XTEA key (RSA encrypted) so later writes skip the RSA step."""
+        async with self._session_lock:
+            if self.session_active or not self.use_session or getattr(self.request, 'public_key', None) is None:
+                return
+            key = ''.join(SystemRandom().choice(SESSION_KEY_CHARS) for x in range(SESSION_KEY_LENGTH))
+            try:
+                response = await self.make_request(2, 'misc.xtea_key=' + key, encrypt=True, timeout=WRITE_TIMEOUT)
+            except BoilerUnavailable:
+                raise
+            except Exception as e:
+                # A controller that ignores the key would time out every write
+                _LOGGER.info(f"Session key not answered ({e!r}) - using RSA for writes")
+                self.use_session = False
+                return
+            if response.status == 0:
+                self.request.xtea_key = XTEA(key.encode('ascii'))
+                _LOGGER.debug("Session key accepted - using XTEA for writes")
+            else:
+                _LOGGER.info(f"Session key not supported ({response.payload}) - using RSA for writes")
+                self.use_session = False
+
+    async def make_request(self, function, payload, encrypt=False, key=None, timeout=None):
+        """Send a request and return its Reply.
+
+        Identical reads in flight at the same time share one request, and
+        settings reads are answered from a short cache when settings_ttl is set.
+        """
+        if encrypt:
+            return await self._make_request(function, payload, encrypt, timeout, [PRIORITY_CONTROL])
+        priority = request_priority.get()
+        if function == 1 and self.settings_ttl:
+            cached = self._settings_cache.get(payload)
+            if cached is not None and cached[0] > time.monotonic():
+                self.cache_hits += 1
+                return cached[1]
+        flight = (function, payload)
+        task = self._inflight.get(flight)
+        if task is None:
+            holder = [priority]
+            task = asyncio.ensure_future(self._read(function, payload, timeout, holder))
+            task.priority = holder
+            self._inflight[flight] = task
+            task.add_done_callback(lambda t: self._flight_done(flight, t))
+        else:
+            self.coalesced += 1
+            # A user read joining a queued poll read moves it up
+            task.priority[0] = min(task.priority[0], priority)
+        # Shielded, so one caller giving up does not cancel the read for the rest
+        return await asyncio.shield(task)
+
+    def _flight_done(self, flight, task):
+        if self._inflight.get(flight) is task:
+            del self._inflight[flight]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every waiter was cancelled
+
+    async def _read(self, function, payload, timeout, holder):
+        generation = self._settings_generation
+        response = await self._make_request(function, payload, False, timeout, holder)
+        if function == 1 and self.settings_ttl and response.status == 0 and generation == self._settings_generation:
+            self._settings_cache[payload] = (time.monotonic() + self.settings_ttl, response)
+        return response
+
+    async def _make_request(self, function, payload, encrypt=False, timeout=None, holder=None):
+        await self.scheduler.acquire(holder or [PRIORITY_POLL])
+        try:
+            if not self.breaker.allow():
+                raise BoilerUnavailable(f"Boiler unreachable, next probe in {self.breaker.seconds_to_probe()}s")
+            # Each in-flight request gets its own frame pair so concurrent
+            # replies never overwrite each other.
+            request = copy.copy(self.request)
+            request.sequencenumber = self._next_sequencenumber()
+            request.payload = payload
+            request.function = function
+            request.encrypted = encrypt
+            request.pincode = self.password
+            _LOGGER.debug(f"Making request to boiler. encrypt={encrypt}, Seqno={request.sequencenumber}")
+            try:
+                response, server = await self._async_send(request, self.addr, timeout or self.timeout)
+            except TimeoutError:
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Never leave the breaker half open - it would refuse everything
+                self.breaker.abort_probe()
+                raise
+            self.breaker.record_success()
+            return response
+        finally:
+            self.scheduler.release()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
 class Controller:
     def __init__(self, host, password, port=1900, seqnums=True):
         self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -0,0 +1,311 @@
+"""NBELocalConnect - Settings restore as a resumable background job."""
+import asyncio
+import datetime
+import time
+from logging import getLogger
+
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+from .protocol import BoilerUnavailable
+
+_LOGGER = getLogger(__name__)
+
+# Seconds between checkpoint writes while a restore runs
+CHECKPOINT_DELAY = 1
+# Attempts per setting when the write times out
+MAX_RETRIES = 3
+# Shortest wait before trying again while the boiler is marked down
+UNAVAILABLE_RETRY = 5
+
+
+def _same_setting(current, wanted) -> bool:
+    """Compare a boiler setting with a backup value ("65" equals "65.0")."""
+    try:
+        return float(current) == float(wanted)
+    except (TypeError, ValueError):
+        return str(current) == str(wanted)
+
+
+def _category(path: str) -> str:
+    return path.split('/')[1]
+
+
+class RestoreJob:
+    """Restores backup settings in the background.
+
+    The keys applied so far are checkpointed to a Store, so a restore that is
+    interrupted by a restart resumes where it stopped instead of starting
+    over. While the boiler is unreachable the job waits instead of failing.
+    """
+    IDLE = 'idle'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, hass, entry_id, coordinator):
+        self.hass = hass
+        self.coordinator = coordinator
+        self._store = Store(hass, 1, f"{DOMAIN}_restore_{entry_id}")
+        self._task = None
+        self._cancel_requested = False
+        self._listeners = []
+        self._load({})
+
+    def _load(self, data):
+        self.status = data.get("status", self.IDLE)
+        self.filename = data.get("filename")
+        self.settings = data.get("settings", {})
+        # None until the diff against the boiler has been made
+        self.to_write = data.get("to_write")
+        self.applied = data.get("applied", [])
+        self.failed = data.get("failed", [])
+        self.skipped = data.get("skipped", 0)
+        self.started = data.get("started")
+        self.finished = data.get("finished")
+        self.phase = None
+        self._run_started = None
+        self._run_done = 0
+
+    def _data(self) -> dict:
+        return {
+            "status": self.status,
+            "filename": self.filename,
+            "settings": self.settings,
+            "to_write": self.to_write,
+            "applied": self.applied,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    # ------------------------------------------------------------------
+    # Progress
+    # ------------------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def total(self) -> int:
+        return len(self.to_write or [])
+
+    @property
+    def done(self) -> int:
+        return len(self.applied) + len(self.failed)
+
+    @property
+    def progress(self):
+        if self.to_write is None:
+            return None
+        if not self.total:
+            return 100
+        return round(self.done / self.total * 100)
+
+    @property
+    def eta(self):
+        """Seconds left, from the pace of the writes in this run."""
+        if self.status != self.RUNNING or not self._run_done or self.to_write is None:
+            return None
+        pace = (time.monotonic() - self._run_started) / self._run_done
+        return round(pace * (self.total - self.done))
+
+    @callback
+    def async_add_listener(self, update_callback):
+        """Call update_callback on progress; returns a function that removes it."""
+        self._listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            if update_callback in self._listeners:
+                self._listeners.remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def _notify(self):
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+
+    async def async_start(self, filename, settings):
+        """Start restoring settings ({path: value}) in the background."""
+        if self.running:
+            raise HomeAssistantError(f"A restore of {self.filename} is already running")
+        self._load({
+            "status": self.RUNNING,
+            "filename": filename,
+            "settings": settings,
+            "started": datetime.datetime.now().isoformat(timespec='seconds'),
+        })
+        await self._store.async_save(self._data())
+        self._start()
+
+    async def async_resume(self):
+        """Resume a restore that was interrupted, if the checkpoint has one."""
+        data = await self._store.async_load()
+        if not isinstance(data, dict) or data.get("status") != self.RUNNING:
+            if isinstance(data, dict):
+                self._load(data)
+            return
+        self._load(data)
+        _LOGGER.info(f"Resuming restore of {self.filename}: {self.done} of {self.total or '?'} settings already done")
+        self._start()
+
+    async def async_cancel(self) -> bool:
+        """Stop a running restore. Settings already written stay written."""
+        if not self.running:
+            return False
+        self._cancel_requested = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def async_shutdown(self):
+        """Stop the job on unload; the checkpoint keeps it resumable."""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._store.async_save(self._data())
+
+    def _start(self):
+        self._cancel_requested = False
+        self._task = self.hass.async_create_background_task(self._async_run(), f"{DOMAIN}_restore")
+        self._notify()
+
+    def _checkpoint(self):
+        self._store.async_delay_save(self._data, CHECKPOINT_DELAY)
+
+    async def _async_notification(self, message):
+        await self.hass.services.async_call("persistent_notification", "create", {
+            "message": message,
+            "title": "NBE Restore",
+            "notification_id": "nbe_restore",
+        })
+
+    # ------------------------------------------------------------------
+    # The job
+    # ------------------------------------------------------------------
+
+    async def _async_run(self):
+        coordinator = self.coordinator
+        try:
+            if self.to_write is None:
+                # Læs de nuværende værdier og skriv kun dem der afviger fra backup'en
+                self.phase = "comparing"
+                self._notify()
+                read = await coordinator.async_read_settings(_category(path) for path in self.settings)
+                self.to_write = []
+                self.skipped = 0
+                for path, value in self.settings.items():
+                    current = coordinator.rtbdata.get(path)
+                    if _category(path) in read and current is not None and _same_setting(current, value):
+                        self.skipped += 1
+                    else:
+                        self.to_write.append(path)
+                await self._store.async_save(self._data())
+                _LOGGER.info(f"Restore {self.filename}: {self.total} settings differ, {self.skipped} already match")
+                if self.to_write:
+                    await self._async_notification(
+                        f"Restoring **{self.filename}** in the background...\n"
+                        f"{self.total} settings differ from the boiler, {self.skipped} already match."
+                    )
+
+            # Skrivningerne sendes én ad gangen - næste sendes når fyret har kvitteret
+            self.phase = "writing"
+            self._run_started = time.monotonic()
+            self._run_done = 0
+            for path in self.to_write:
+                if path in self.applied or path in self.failed:
+                    continue
+                if await self._async_write(path, self.settings[path]):
+                    self.applied.append(path)
+                else:
+                    self.failed.append(path)
+                self._run_done += 1
+                self._checkpoint()
+                self._notify()
+
+            # Verifikation: læs de skrevne kategorier igen og sammenlign
+            if self.applied:
+                self.phase = "verifying"
+                self._notify()
+                verified = await coordinator.async_read_settings(_category(path) for path in self.applied)
+                for path in list(self.applied):
+                    if _category(path) not in verified:
+                        coordinator.mark_stale(path)
+                    elif not _same_setting(coordinator.rtbdata.get(path), self.settings[path]):
+                        _LOGGER.error(f"Restore of {path} not confirmed: boiler reports {coordinator.rtbdata.get(path)}, wanted {self.settings[path]}")
+                        self.applied.remove(path)
+                        self.failed.append(path)
+
+            self.status = self.DONE
+            self.phase = None
+            self.finished = datetime.datetime.now().isoformat(timespec='seconds')
+            await self._store.async_save(self._data())
+            self._notify()
+            _LOGGER.info(f"✅ Restore complete from {self.filename}: {len(self.applied)} written, {self.skipped} skipped, {len(self.failed)} failed")
+            message = f"NBE restore from **{self.filename}** complete.\n✅ {len(self.applied)} settings written, {self.skipped} already matched."
+            if self.failed:
+                message += f"\n❌ {len(self.failed)} settings failed - check log."
+            await self._async_notification(message)
+            # Værdierne er allerede læst ind - opdater entities uden en fuld poll
+            coordinator.async_update_listeners()
+        except asyncio.CancelledError:
+            self.phase = None
+            if self._cancel_requested:
+                self.status = self.CANCELLED
+                self.finished = datetime.datetime.now().isoformat(timespec='seconds')
+                await self._store.async_save(self._data())
+                self._notify()
+                _LOGGER.info(f"Restore of {self.filename} cancelled after {self.done} of {self.total} settings")
+                await self._async_notification(
+                    f"NBE restore from **{self.filename}** cancelled.\n{len(self.applied)} settings were written before it stopped."
+                )
+                coordinator.async_update_listeners()
+            raise
+
+    async def _async_write(self, path, value) -> bool:
+        """Write one setting; True when the boiler acknowledged it."""
+        attempt = 0
+        while True:
+            try:
+                result = await self.coordinator.proxy.set(path, str(value))
+            except BoilerUnavailable:
+                # Fyret er nede - vent i stedet for at fejle resten af restore'en
+                self.phase = "waiting for boiler"
+                self._notify()
+                await asyncio.sleep(max(UNAVAILABLE_RETRY, self.coordinator.proxy.breaker.seconds_to_probe()))
+                self.phase = "writing"
+                continue
+            except OSError as e:
+                # Timeout - prøv igen med det samme, timeout'en har allerede ventet
+                attempt += 1
+                if attempt < MAX_RETRIES:
+                    _LOGGER.warning(f"Restore timeout for {path}, retrying ({attempt}/{MAX_RETRIES - 1})...")
+                    continue
+                _LOGGER.error(f"Restore error for {path}: {e}")
+                return False
+            except Exception as e:
+                # Other errors (index out of range etc) - no point retrying
+                _LOGGER.error(f"Restore error for {path}: {e}")
+                return False
+            if result == ('OK',):
+                if attempt:
+                    _LOGGER.info(f"Restore retry succeeded for {path} (attempt {attempt + 1})")
+                return True
+            _LOGGER.error(f"Restore of {path} rejected by boiler: {result[0]}")
+            return False
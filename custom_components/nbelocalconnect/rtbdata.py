@@ -1,34 +1,134 @@
 """RTBData class for NBELocalConnect."""
 from logging import getLogger
+from math import isfinite
+from sys import intern
 
 _LOGGER = getLogger(__name__)
 
 
+_INVALID = object()
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _INVALID
+
+
+def _parse_array(value):
+    try:
+        return tuple(float(v) for v in value.split('=')[-1].split(',') if v.strip())
+    except (AttributeError, ValueError):
+        return _INVALID
+
+
 class RTBData:
-    """Class to hold and access all boiler data."""
+    """Class to hold and access all boiler data.
+
+    Values are kept as the raw strings the boiler sends (get()). Typed reads
+    (get_float/get_int/get_array) parse a value once and cache the result
+    until the raw value changes, so entities don't re-parse on every state
+    write.
+
+    Every call to set()/set_payload() that changes something bumps
+    generation; each key remembers the generation it last changed in, and
+    changed keys are collected until take_changed().
+
+    Keys are also indexed as endpoint -> category -> key ("settings/boiler/temp"
+    is endpoint "settings", category "boiler"; "operating_data/state" has
+    category ""). The index grows when a new key is first set, so prefix
+    queries only touch the keys they return.
+    """
     
     def __init__(self, data):
         """Initialize with data list."""
         self.data = {}
+        # prefix -> {raw key: interned "prefix/key"}, so a poll only builds new key strings once
+        self._keys = {}
+        # key -> parsed value (or _INVALID), dropped when the raw value changes
+        self._numbers = {}
+        self._arrays = {}
+        self.generation = 0
+        self._generations = {}
+        self._changed = set()
+        # endpoint -> category -> {key: None} (insertion ordered set)
+        self._index = {}
         self.set(data)
     
     def set(self, data):
-        """Update data dictionary. Preserve last known value for keys missing in this poll."""
+        """Update data dictionary. Preserve last known value for keys missing in this poll.
+
+        Returns the set of keys whose value changed.
+        """
+        changed = set()
         if not data:
             _LOGGER.warning("set() called with empty data")
-            return
+            return changed
         
+        generation = self.generation + 1
         for item in data:
             if '=' in item:
                 # Format: "key=value"
                 key, value = item.split('=', 1)
-                self.data[key] = value
+                old = self.data.get(key)
+                if old != value:
+                    if old is None:
+                        self._index_key(key)
+                    self.data[key] = value
+                    self._numbers.pop(key, None)
+                    self._arrays.pop(key, None)
+                    self._generations[key] = generation
+                    changed.add(key)
             else:
                 # Format: just "key" (no value) - skip
                 _LOGGER.debug(f"Skipping keyless item: {item}")
         
-        _LOGGER.debug(f"RTBData updated with {len(self.data)} keys")
+        if changed:
+            self.generation = generation
+            self._changed |= changed
+        _LOGGER.debug(f"RTBData updated with {len(self.data)} keys, {len(changed)} changed")
+        return changed
     
+    def set_payload(self, prefix, payload):
+        """Parse a raw "key=value;key=value" reply straight into the store.
+
+        Keys are stored as prefix + key. Returns the number of keys set;
+        the keys that changed are collected for take_changed().
+        """
+        keys = self._keys.get(prefix)
+        if keys is None:
+            keys = self._keys[prefix] = {}
+        data = self.data
+        numbers = self._numbers
+        arrays = self._arrays
+        generations = self._generations
+        changed = self._changed
+        generation = self.generation + 1
+        count = 0
+        moved = False
+        for item in payload.split(';'):
+            key, sep, value = item.partition('=')
+            if sep:
+                full_key = keys.get(key)
+                if full_key is None:
+                    full_key = keys[key] = intern(prefix + key)
+                old = data.get(full_key)
+                if old != value:
+                    if old is None:
+                        self._index_key(full_key)
+                    data[full_key] = value
+                    # Changed value - parsed again on the next typed read
+                    numbers.pop(full_key, None)
+                    arrays.pop(full_key, None)
+                    generations[full_key] = generation
+                    changed.add(full_key)
+                    moved = True
+                count += 1
+        if moved:
+            self.generation = generation
+        return count
+
     def get(self, key):
         """Get value for specific key."""
         value = self.data.get(key)
@@ -38,13 +138,79 @@ class RTBData:
         
         return value
     
+    def _index_key(self, key):
+        endpoint, _, rest = key.partition('/')
+        category = rest.partition('/')[0] if '/' in rest else ''
+        categories = self._index.get(endpoint)
+        if categories is None:
+            categories = self._index[endpoint] = {}
+        keys = categories.get(category)
+        if keys is None:
+            keys = categories[category] = {}
+        keys[key] = None
+
+    def get_endpoints(self):
+        """Get the endpoints that have keys ("operating_data", "settings", ...)."""
+        return list(self._index)
+
+    def get_categories(self, endpoint):
+        """Get the categories of an endpoint ("boiler", "hot_water", ... for settings)."""
+        return list(self._index.get(endpoint, ()))
+
+    def get_keys(self, endpoint, category=None):
+        """Get the keys of an endpoint, or of one of its categories."""
+        categories = self._index.get(endpoint)
+        if not categories:
+            return []
+        if category is not None:
+            return list(categories.get(category, ()))
+        return [key for keys in categories.values() for key in keys]
+
+    def key_generation(self, key):
+        """Generation in which key last changed (0 if never set)."""
+        return self._generations.get(key, 0)
+
+    def take_changed(self):
+        """Return the keys changed since the last call and start a new set."""
+        changed = self._changed
+        self._changed = set()
+        return changed
+
+    def get_float(self, key, default=None):
+        """Get value as a float, or default if missing or not numeric."""
+        number = self._numbers.get(key)
+        if number is None:
+            value = self.data.get(key)
+            if value is None:
+                return default
+            number = self._numbers[key] = _parse_number(value)
+        return default if number is _INVALID else number
+
+    def get_int(self, key, default=None):
+        """Get value as an int ("65.0" gives 65), or default if missing or not finite."""
+        number = self.get_float(key)
+        return default if number is None or not isfinite(number) else int(number)
+
+    def get_array(self, key):
+        """Get a "v1,v2,..." value as a tuple of floats, or None."""
+        values = self._arrays.get(key)
+        if values is None:
+            value = self.data.get(key)
+            if value is None:
+                return None
+            values = self._arrays[key] = _parse_array(value)
+        return None if values is _INVALID else values
+
     def get_all_starting_with(self, prefix):
         """Get all keys that start with prefix."""
-        result = {}
-        for key, value in self.data.items():
-            if key.startswith(prefix):
-                result[key] = value
-        return result
+        # "endpoint/" and "endpoint/category/" are looked up in the index
+        parts = prefix.split('/')
+        if prefix.endswith('/') and len(parts) in (2, 3):
+            keys = self.get_keys(parts[0], parts[1] if len(parts) == 3 else None)
+        else:
+            keys = self.data
+        data = self.data
+        return {key: data[key] for key in keys if key.startswith(prefix)}
     
     def get_all_keys(self):
         """Get list of all available keys."""
@@ -1,9 +1,11 @@
 """NBELocalConnect - Select platform for backup file and boiler settings."""
-import os
 from homeassistant.components.select import SelectEntity
+from homeassistant.core import callback
 from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
-from .const import DOMAIN, NBE_BACKUP_DIR
+from .const import DOMAIN
+from .backup_store import CATALOG_KEY
+from .entity import RTBKeyEntity
 from logging import getLogger
 
 _LOGGER = getLogger(__name__)
@@ -177,13 +179,12 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     entities = []
 
     # --- Backup select ---
-    backup_select = NBEBackupSelectEntity(coordinator, hass, f"{entry_id}_backup_select")
+    backup_select = NBEBackupSelectEntity(coordinator, hass, hass.data[DOMAIN][CATALOG_KEY], f"{entry_id}_backup_select")
     entities.append(backup_select)
     hass.data[DOMAIN][entry_id + '_backup_select'] = backup_select
 
     # --- Settings select entities ---
-    all_keys = coordinator.rtbdata.get_all_keys()
-    for key in all_keys:
+    for key in coordinator.rtbdata.get_keys('settings'):
         if key not in ALL_SETTINGS_SELECT_KEYS:
             continue
 
@@ -217,29 +218,18 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
 class NBEBackupSelectEntity(CoordinatorEntity, SelectEntity):
     """Select entity that lists available NBE backup files."""
 
-    def __init__(self, coordinator, hass, uid):
+    def __init__(self, coordinator, hass, catalog, uid):
         super().__init__(coordinator)
         self._hass = hass
+        self.catalog = catalog
         self.uid = uid
         self._current_option = NO_BACKUPS
         self._options = [NO_BACKUPS]
 
-    def _get_backup_files_sync(self):
-        if not os.path.exists(NBE_BACKUP_DIR):
-            return []
-        try:
-            files = [f for f in os.listdir(NBE_BACKUP_DIR) if f.endswith('.json')]
-            files.sort(key=lambda f: os.path.getmtime(os.path.join(NBE_BACKUP_DIR, f)), reverse=True)
-            return files
-        except Exception as e:
-            _LOGGER.error(f"Error reading backup directory: {e}")
-            return []
-
-    async def _async_get_backup_files(self):
-        return await self._hass.async_add_executor_job(self._get_backup_files_sync)
-
-    async def _async_refresh_options(self, select_newest=False):
-        files = await self._async_get_backup_files()
+    @callback
+    def _refresh_options(self, select_newest=False):
+        # The shared catalog holds the list in memory - no disk access here
+        files = self.catalog.names
         if files:
             self._options = files
             if select_newest or self._current_option not in files:
@@ -251,10 +241,8 @@ class NBEBackupSelectEntity(CoordinatorEntity, SelectEntity):
 
     async def async_added_to_hass(self):
         await super().async_added_to_hass()
-        await self._async_refresh_options()
-
-    def _handle_coordinator_update(self):
-        self._hass.async_create_task(self._async_refresh_options())
+        self.async_on_remove(self.catalog.async_add_listener(self._refresh_options))
+        self._refresh_options()
 
     @property
     def name(self):
@@ -281,7 +269,7 @@ class NBEBackupSelectEntity(CoordinatorEntity, SelectEntity):
         self.async_write_ha_state()
 
     async def async_refresh_options(self):
-        await self._async_refresh_options(select_newest=True)
+        self._refresh_options(select_newest=True)
 
     @property
     def device_info(self):
@@ -296,7 +284,7 @@ class NBEBackupSelectEntity(CoordinatorEntity, SelectEntity):
 # SETTINGS SELECT
 # ============================================================
 
-class NBESettingsSelect(CoordinatorEntity, SelectEntity):
+class NBESettingsSelect(RTBKeyEntity, SelectEntity):
     """Select entity for a boiler setting with discrete options."""
 
     def __init__(self, coordinator, hass, name, client_key, uid, base_option_map):
@@ -308,14 +296,17 @@ class NBESettingsSelect(CoordinatorEntity, SelectEntity):
         self._base_option_map = base_option_map  # {label: boilervalue}
         self._option_type = _get_option_type(client_key)
         self._pending_option = None  # Snap-back fix
+        # L/T options show which other outputs/inputs are in use
+        if self._option_type == "L":
+            self._other_keys = SETTINGS_L_KEYS - {client_key}
+        elif self._option_type in ("T", "T_WWW"):
+            self._other_keys = SETTINGS_T_KEYS - {client_key}
+        else:
+            self._other_keys = set()
 
     def _get_own_value(self) -> int | None:
         """Get boiler value for this entity."""
-        raw = self.coordinator.rtbdata.get(self.client_key)
-        try:
-            return int(float(raw))
-        except (TypeError, ValueError):
-            return None
+        return self.coordinator.rtbdata.get_int(self.client_key)
 
     def _get_used_by(self) -> dict[int, list[str]]:
         """Get dict of value -> entity names for all used L/T assignments."""
@@ -326,14 +317,8 @@ class NBESettingsSelect(CoordinatorEntity, SelectEntity):
         used_by: dict[int, list[str]] = {}
 
         for key in all_keys:
-            raw = self.coordinator.rtbdata.get(key)
-
-            try:
-                value = int(float(raw))
-            except (TypeError, ValueError):
-                continue
-
-            if value == 0:
+            value = self.coordinator.rtbdata.get_int(key)
+            if value is None or value == 0:
                 continue
 
             name = _key_to_name(key)
@@ -376,10 +361,15 @@ class NBESettingsSelect(CoordinatorEntity, SelectEntity):
                 return opt
         return None
 
+    @property
+    def subscribed_keys(self):
+        return (self.client_key, *self._other_keys)
+
+    @callback
     def _handle_coordinator_update(self) -> None:
-        """Clear pending option when coordinator updates."""
+        """A subscribed key changed or was read back - clear pending option."""
         self._pending_option = None
-        super()._handle_coordinator_update()
+        self.async_write_ha_state()
 
     async def async_select_option(self, option: str) -> None:
         # Strip "(entity name)" suffix if present
@@ -429,12 +419,9 @@ class NBESettingsSelect(CoordinatorEntity, SelectEntity):
             {"key": self.client_key, "value": val},
         )
 
+        # set_setting reads the key back, which updates this and the L/T dropdowns sharing it
         _LOGGER.info(f"Set {self.client_key} = {val} ({option})")
 
-        # Optimistic update: update rtbdata immediately so all dropdowns refresh at once
-        self.coordinator.rtbdata.data[self.client_key] = str(val)
-        self.coordinator.async_update_listeners()
-
 
     @property
     def name(self):
@@ -453,6 +440,7 @@ class NBESettingsSelect(CoordinatorEntity, SelectEntity):
         attrs = {
             "datapoint_path": self.client_key,
             "writable": True,
+            "stale": self.coordinator.stale,
         }
         return attrs
 
@@ -15,6 +15,8 @@ from homeassistant.components.binary_sensor import (
     BinarySensorEntity,
 )
 from .const import DOMAIN
+from .protocol import PRIORITY_NAMES
+from .entity import RTBKeyEntity
 from datetime import datetime, timedelta
 from logging import getLogger
 
@@ -183,8 +185,12 @@ async def async_setup_entry(hass, entry, async_add_entities):
     # ========================================================================
     _LOGGER.info("Scanning rtbdata for all available keys...")
     
-    all_keys = coordinator.rtbdata.get_all_keys()
-    _LOGGER.info(f"Found {len(all_keys)} total keys in rtbdata")
+    # Settings håndteres af number platform - undtagen dem der er read-only sensorer
+    SETTINGS_AS_SENSORS = {'settings/ignition/ignition_number'}
+    rtbdata = coordinator.rtbdata
+    all_keys = [key for endpoint in rtbdata.get_endpoints() if endpoint != 'settings' for key in rtbdata.get_keys(endpoint)]
+    all_keys += [key for key in SETTINGS_AS_SENSORS if rtbdata.get(key) is not None]
+    _LOGGER.info(f"Found {len(all_keys)} sensor keys in rtbdata")
     
     # Create sensor for each key
     for key in all_keys:
@@ -197,12 +203,6 @@ async def async_setup_entry(hass, entry, async_add_entities):
             _LOGGER.debug(f"Skipping advanced_data duplicate: {key}")
             continue
         
-        # Skip settings (håndteres af number platform)
-        # Exception: settings that are read-only sensors
-        SETTINGS_AS_SENSORS = {'settings/ignition/ignition_number'}
-        if key.startswith('settings/') and key not in SETTINGS_AS_SENSORS:
-            continue
-
         # Skip binære timer data
         if any(day in key for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday', 'allweek']):
             _LOGGER.debug(f"Skipping binary timer data: {key}")
@@ -285,6 +285,16 @@ async def async_setup_entry(hass, entry, async_add_entities):
         RTBAugerCountdownSensor(coordinator, f'{entry_id}_v2_auger_countdown')
     )
 
+    # CONNECTION STATE (circuit breaker)
+    sensors.append(
+        RTBConnectionSensor(coordinator, f'{entry_id}_v2_connection_state')
+    )
+
+    # RESTORE PROGRESS (background restore job)
+    sensors.append(
+        RTBRestoreProgressSensor(coordinator, hass.data[DOMAIN][entry_id + '_restore'], f'{entry_id}_v2_restore_progress')
+    )
+
     # ENERGY SENSORS
     energy_kwh = RTBEnergySensor(coordinator, f'{entry_id}_v2_energy_kwh', "kWh")
     energy_wh = RTBEnergySensor(coordinator, f'{entry_id}_v2_energy_wh', "Wh")
@@ -294,14 +304,14 @@ async def async_setup_entry(hass, entry, async_add_entities):
     hass.data[DOMAIN][entry_id + '_energy_kwh'] = energy_kwh
     hass.data[DOMAIN][entry_id + '_energy_wh'] = energy_wh
 
-    async_add_entities(sensors, True)
+    async_add_entities(sensors)
 
 
 # =============================================================================
 # SENSOR CLASSES
 # =============================================================================
 
-class RTBDynamicSensor(CoordinatorEntity, SensorEntity):
+class RTBDynamicSensor(RTBKeyEntity, SensorEntity):
     """Dynamisk sensor for enhver key."""
     
     def __init__(self, coordinator, name, client_key, uid, unit, device_class, state_class):
@@ -313,7 +323,7 @@ class RTBDynamicSensor(CoordinatorEntity, SensorEntity):
         self._unit = unit
         self._device_class = device_class
         self._state_class = state_class
-    
+
     @property
     def name(self):
         return self.sensorname
@@ -329,10 +339,10 @@ class RTBDynamicSensor(CoordinatorEntity, SensorEntity):
 
         # content skal ganges med 10 (kg)
         if 'content' in self.client_key and 'min_content' not in self.client_key and 'operating_data' in self.client_key:
-            try:
-                return float(data) * 10 if data else None
-            except:
-                return data
+            if not data:
+                return None
+            content = self.coordinator.rtbdata.get_float(self.client_key)
+            return content * 10 if content is not None else data
         
         return data
     
@@ -355,6 +365,7 @@ class RTBDynamicSensor(CoordinatorEntity, SensorEntity):
         return {
             "datapoint_path": self.client_key,
             "writable": is_writable,
+            "stale": self.coordinator.stale,
         }
         
     @property
@@ -440,9 +451,11 @@ class RTBDynamicSensor(CoordinatorEntity, SensorEntity):
         return False
 
 
-class RTBAugerCountdownSensor(CoordinatorEntity, SensorEntity):
+class RTBAugerCountdownSensor(RTBKeyEntity, SensorEntity):
     """Real-time countdown sensor for the auger weighing test (settings/auger/forced_run)."""
 
+    subscribed_keys = ('settings/auger/forced_run',)
+
     def __init__(self, coordinator, uid):
         super().__init__(coordinator)
         self.uid = uid
@@ -472,12 +485,8 @@ class RTBAugerCountdownSensor(CoordinatorEntity, SensorEntity):
 
     @callback
     def _handle_coordinator_update(self) -> None:
-        """Sync countdown to boiler value on each poll."""
-        raw = self.coordinator.rtbdata.get('settings/auger/forced_run')
-        try:
-            val = int(float(raw)) if raw else 0
-        except (ValueError, TypeError):
-            val = 0
+        """Sync countdown to boiler value when it changes."""
+        val = self.coordinator.rtbdata.get_int('settings/auger/forced_run', 0)
 
         if val > 0:
             self._last_value = val
@@ -532,7 +541,7 @@ class RTBAugerCountdownSensor(CoordinatorEntity, SensorEntity):
     def device_info(self):
         return {"identifiers": {(DOMAIN, self.coordinator.entry_id)}}
 
-class RTBBinarySensor(CoordinatorEntity, BinarySensorEntity):
+class RTBBinarySensor(RTBKeyEntity, BinarySensorEntity):
     """Binary sensor."""
     
     def __init__(self, coordinator, name, client_key, uid, device_class):
@@ -541,7 +550,7 @@ class RTBBinarySensor(CoordinatorEntity, BinarySensorEntity):
         self.sensorname = name
         self.uid = uid
         self._device_class = device_class
-    
+
     @property
     def name(self):
         return self.sensorname
@@ -555,10 +564,7 @@ class RTBBinarySensor(CoordinatorEntity, BinarySensorEntity):
         s = self.coordinator.rtbdata.get(self.client_key)
         
         if "power_pct" in self.client_key:
-            try:
-                return int(s) > 0
-            except:
-                return False
+            return self.coordinator.rtbdata.get_int(self.client_key, 0) > 0
         
         if "off_on_alarm" in self.client_key:
             return s == "2"
@@ -578,6 +584,7 @@ class RTBBinarySensor(CoordinatorEntity, BinarySensorEntity):
         return {
             "datapoint_path": self.client_key,
             "writable": False,
+            "stale": self.coordinator.stale,
         }
 
     @property
@@ -618,11 +625,9 @@ class RTBConsumptionHistorySensor(CoordinatorEntity, SensorEntity):
     @property
     def state(self):
         """Return current period (nyeste)."""
-        data = self.coordinator.rtbdata.get(self.client_key)
-        if data:
-            values = self._parse_consumption_data(data)
-            if values and len(values) > 0:
-                return values[0]
+        values = self._parse_consumption_data(self.coordinator.rtbdata.get_array(self.client_key))
+        if values:
+            return values[0]
         return None
     
     @property
@@ -640,11 +645,7 @@ class RTBConsumptionHistorySensor(CoordinatorEntity, SensorEntity):
     @property
     def extra_state_attributes(self):
         """Return attributes med values array."""
-        data = self.coordinator.rtbdata.get(self.client_key)
-        if not data:
-            return {}
-        
-        values = self._parse_consumption_data(data)
+        values = self._parse_consumption_data(self.coordinator.rtbdata.get_array(self.client_key))
         if not values:
             return {}
         
@@ -666,11 +667,12 @@ class RTBConsumptionHistorySensor(CoordinatorEntity, SensorEntity):
             "identifiers": {(DOMAIN, self.coordinator.entry_id)},
         }        
     
-    def _parse_consumption_data(self, data_string):
-        """Parse og sorter consumption data."""
+    def _parse_consumption_data(self, values):
+        """Sorter consumption data (allerede parset af RTBData)."""
+        if not values:
+            return None
         try:
-            values_str = data_string.split('=')[1] if '=' in data_string else data_string
-            values = [float(v.strip()) for v in values_str.split(',') if v.strip()]
+            values = list(values)
             
             # HOURLY: Bagud fra current hour
             if 'hours' in self.client_key or 'hourly' in self.client_key:
@@ -766,10 +768,12 @@ class RTBInfoSensor(CoordinatorEntity, SensorEntity):
         return True
 
 
-class RTBAlarmMsgSensor(CoordinatorEntity, SensorEntity):
+class RTBAlarmMsgSensor(RTBKeyEntity, SensorEntity):
     _attr_has_entity_name = False
     """Sensor showing translated boiler state text."""
 
+    subscribed_keys = ('operating_data/state',)
+
     def __init__(self, coordinator, uid):
         super().__init__(coordinator)
         self.uid = uid
@@ -820,9 +824,11 @@ class RTBAlarmMsgSensor(CoordinatorEntity, SensorEntity):
         return True
 
 
-class RTBSubstateMsgSensor(CoordinatorEntity, SensorEntity):
+class RTBSubstateMsgSensor(RTBKeyEntity, SensorEntity):
     """Sensor showing translated substate text."""
 
+    subscribed_keys = ('operating_data/substate',)
+
     def __init__(self, coordinator, uid):
         super().__init__(coordinator)
         self.uid = uid
@@ -931,12 +937,14 @@ class RTBInfoMsgSensor(CoordinatorEntity, SensorEntity):
     def entity_registry_enabled_default(self):
         return True
 
-class RTBCountdownSensor(CoordinatorEntity, SensorEntity):
+class RTBCountdownSensor(RTBKeyEntity, SensorEntity):
     """Sensor showing a real-time countdown based on substate_sec from the boiler."""
 
     # States where countdown should be zero (boiler not in an active timed step)
     IDLE_STATES = {'5', '6', '9', '10', '22', '23', '24', '25'}
 
+    subscribed_keys = ('operating_data/state', 'operating_data/substate_sec')
+
     def __init__(self, coordinator, uid):
         super().__init__(coordinator)
         self.uid = uid
@@ -975,11 +983,7 @@ class RTBCountdownSensor(CoordinatorEntity, SensorEntity):
             self.async_write_ha_state()
             return
 
-        raw = self.coordinator.rtbdata.get('operating_data/substate_sec')
-        try:
-            val = int(raw) if raw else 0
-        except (ValueError, TypeError):
-            val = 0
+        val = self.coordinator.rtbdata.get_int('operating_data/substate_sec', 0)
 
         if val > 1:
             self._last_value = val
@@ -1038,6 +1042,137 @@ class RTBCountdownSensor(CoordinatorEntity, SensorEntity):
     def entity_registry_enabled_default(self):
         return True
 
+class RTBConnectionSensor(CoordinatorEntity, SensorEntity):
+    """Diagnostic sensor showing the proxy circuit breaker state."""
+
+    def __init__(self, coordinator, uid):
+        super().__init__(coordinator)
+        self.uid = uid
+
+    @property
+    def name(self):
+        return "Connection State"
+
+    @property
+    def unique_id(self):
+        return self.uid
+
+    @property
+    def state(self):
+        return self.coordinator.proxy.breaker.state
+
+    @property
+    def icon(self):
+        if self.coordinator.proxy.breaker.is_closed:
+            return "mdi:lan-connect"
+        return "mdi:lan-disconnect"
+
+    @property
+    def extra_state_attributes(self):
+        proxy = self.coordinator.proxy
+        breaker = proxy.breaker
+        waits = proxy.scheduler.waits
+        attributes = {
+            "consecutive_failures": breaker.failures,
+            "down_since": datetime.fromtimestamp(breaker.opened_at).isoformat(timespec='seconds') if breaker.opened_at else None,
+            "next_probe_in": breaker.seconds_to_probe(),
+            "probe_backoff": breaker.backoff,
+            "srtt_ms": round(proxy.rtt.srtt * 1000, 1) if proxy.rtt.srtt is not None else None,
+            "rto_ms": round(proxy.rtt.rto * 1000),
+            "requests": proxy.requests,
+            "retransmits": proxy.retransmits,
+            "losses": proxy.losses,
+            "stale_replies": proxy.stale_replies,
+            "coalesced_reads": proxy.coalesced,
+            "settings_cache_hits": proxy.cache_hits,
+            "queue_depth": proxy.scheduler.depth,
+            "max_queue_depth": proxy.scheduler.max_depth,
+            "max_wait_ms": round(max(longest for count, total, longest in waits.values()) * 1000, 1),
+            "handshake_cached": proxy.from_cache,
+            "write_encryption": "xtea" if proxy.session_active else "rsa",
+        }
+        # Average queue wait per request priority
+        for priority, (count, total, longest) in waits.items():
+            attributes[f"{PRIORITY_NAMES[priority]}_wait_ms"] = round(total / count * 1000, 1) if count else None
+        return attributes
+
+    @property
+    def device_info(self):
+        return {"identifiers": {(DOMAIN, self.coordinator.entry_id)}}
+
+    @property
+    def entity_category(self):
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def entity_registry_enabled_default(self):
+        return True
+
+class RTBRestoreProgressSensor(CoordinatorEntity, SensorEntity):
+    """Diagnostic sensor showing progress of the background settings restore."""
+
+    def __init__(self, coordinator, job, uid):
+        super().__init__(coordinator)
+        self.job = job
+        self.uid = uid
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        self.async_on_remove(self.job.async_add_listener(self.async_write_ha_state))
+
+    @property
+    def name(self):
+        return "Restore Progress"
+
+    @property
+    def unique_id(self):
+        return self.uid
+
+    @property
+    def state(self):
+        return self.job.progress
+
+    @property
+    def unit_of_measurement(self):
+        return "%"
+
+    @property
+    def icon(self):
+        if self.job.running:
+            return "mdi:backup-restore"
+        return "mdi:restore"
+
+    @property
+    def extra_state_attributes(self):
+        job = self.job
+        eta = job.eta
+        return {
+            "status": job.status,
+            "phase": job.phase,
+            "file": job.filename,
+            "done": job.done,
+            "total": job.total,
+            "written": len(job.applied),
+            "skipped": job.skipped,
+            "failed": len(job.failed),
+            "eta_seconds": eta,
+            "eta": (datetime.now() + timedelta(seconds=eta)).isoformat(timespec='seconds') if eta is not None else None,
+            "started": job.started,
+            "finished": job.finished,
+        }
+
+    @property
+    def device_info(self):
+        return {"identifiers": {(DOMAIN, self.coordinator.entry_id)}}
+
+    @property
+    def entity_category(self):
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def entity_registry_enabled_default(self):
+        return True
+
 class RTBEnergySensor(CoordinatorEntity, SensorEntity, RestoreEntity):
     """Accumulated energy sensor calculated from operating_data/power_kw.
 
@@ -1076,11 +1211,7 @@ class RTBEnergySensor(CoordinatorEntity, SensorEntity, RestoreEntity):
 
         if self._last_update_time is not None:
             delta_hours = (now - self._last_update_time).total_seconds() / 3600
-            raw = self.coordinator.rtbdata.get("operating_data/power_kw")
-            try:
-                power_kw = float(raw) if raw else 0.0
-            except (ValueError, TypeError):
-                power_kw = 0.0
+            power_kw = self.coordinator.rtbdata.get_float("operating_data/power_kw", 0.0)
 
             delta_kwh = power_kw * delta_hours
             if delta_kwh > 0:
@@ -1,8 +1,9 @@
 """NBELocalConnect - Switch platform for boolean boiler settings."""
 from homeassistant.components.switch import SwitchEntity
+from homeassistant.core import callback
 from homeassistant.helpers.entity import EntityCategory
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from .const import DOMAIN
+from .entity import RTBKeyEntity
 from logging import getLogger
 
 _LOGGER = getLogger(__name__)
@@ -26,10 +27,10 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     entry_id = config_entry.entry_id
 
     entities = []
-    all_keys = set(coordinator.rtbdata.get_all_keys())
+    settings_keys = set(coordinator.rtbdata.get_keys('settings'))
 
     for key, name, enabled in SWITCH_SETTINGS:
-        if key not in all_keys:
+        if key not in settings_keys:
             _LOGGER.debug(f"Switch key not found on this boiler: {key}")
             continue
         uid = f"{entry_id}_v2_sw_{key.replace('/', '_')}"
@@ -39,7 +40,7 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     async_add_entities(entities)
 
 
-class NBESettingsSwitch(CoordinatorEntity, SwitchEntity):
+class NBESettingsSwitch(RTBKeyEntity, SwitchEntity):
     """Switch entity for a boolean boiler setting (0/1)."""
 
     def __init__(self, coordinator, hass, name, client_key, uid, enabled_default):
@@ -63,16 +64,13 @@ class NBESettingsSwitch(CoordinatorEntity, SwitchEntity):
     def is_on(self) -> bool:
         if self._pending_state is not None:
             return self._pending_state
-        raw = self.coordinator.rtbdata.get(self.client_key)
-        try:
-            return int(float(raw)) != 0
-        except (TypeError, ValueError):
-            return False
+        return self.coordinator.rtbdata.get_int(self.client_key, 0) != 0
 
+    @callback
     def _handle_coordinator_update(self) -> None:
-        """Clear pending state when coordinator updates."""
+        """Own key changed or was read back after a write - clear pending state."""
         self._pending_state = None
-        super()._handle_coordinator_update()
+        self.async_write_ha_state()
 
     @property
     def entity_category(self):
@@ -83,6 +81,7 @@ class NBESettingsSwitch(CoordinatorEntity, SwitchEntity):
         return {
             "datapoint_path": self.client_key,
             "writable": True,
+            "stale": self.coordinator.stale,
         }
 
     async def async_turn_on(self, **kwargs) -> None:
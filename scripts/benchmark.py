@@ -0,0 +1,89 @@
+"""Micro-benchmarks for the request frame encoder and the RTBData poll path.
+
+Runs without Home Assistant; RSA frames are only measured when pycryptodome
+is installed. Check out an older commit and run the script again to compare:
+
+    python scripts/benchmark.py
+"""
+import copy
+import os
+import sys
+import timeit
+import types
+
+COMPONENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'nbelocalconnect')
+
+# Import the modules without running the integration's __init__ (needs Home Assistant)
+package = types.ModuleType('nbelocalconnect')
+package.__path__ = [COMPONENT]
+sys.modules['nbelocalconnect'] = package
+
+from nbelocalconnect.frames import Request_frame  # noqa: E402
+from nbelocalconnect.rtbdata import RTBData  # noqa: E402
+
+# A 300 key reply, about the size of a settings or operating_data read
+PREFIX = 'operating_data/'
+PAYLOAD = ';'.join(f'key_{i}={i * 1.5}' for i in range(300))
+
+
+def _rsa_key():
+    try:
+        from Crypto.PublicKey import RSA
+        from Crypto.Util.number import getPrime, inverse
+    except ImportError:
+        return None
+    # 512 bit, like the controller's key
+    e = 65537
+    while True:
+        p, q = getPrime(256), getPrime(256)
+        if (p * q).bit_length() == 512 and (p - 1) % e and (q - 1) % e:
+            return RSA.construct((p * q, e, inverse(e, (p - 1) * (q - 1)), p, q)).publickey()
+
+
+def _best(func, number, repeat=5):
+    """Best time per call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def _template(**fields):
+    request = Request_frame()
+    request.controllerid = '12345'
+    request.pincode = '1234567890'
+    for name, value in fields.items():
+        setattr(request, name, value)
+    return request
+
+
+def bench_frames():
+    request = _template(function=4, sequencenumber=7, payload='*')
+    print(f"encode(), plain read frame:  {_best(request.encode, 100000):.2f} us")
+
+    def copy_encode(template=request):
+        frame = copy.copy(template)
+        frame.sequencenumber = 8
+        frame.encode()
+
+    print(f"copy + encode, plain frames: {1e6 / _best(copy_encode, 100000):,.0f} /s")
+    key = _rsa_key()
+    if key is None:
+        print("copy + encode, RSA frames:   skipped (pycryptodome not installed)")
+        return
+    encrypted = _template(function=2, sequencenumber=7, payload='boiler.temp=71', encrypted=True, public_key=key)
+    print(f"copy + encode, RSA frames:   {1e6 / _best(lambda: copy_encode(encrypted), 5000):,.0f} /s")
+
+
+def bench_rtbdata():
+    data = RTBData([PREFIX + 'key_0=0'])
+
+    def prefixed_set():
+        # The poll path before set_payload(): prefixed item list, then set()
+        data.set([PREFIX + item for item in PAYLOAD.split(';')])
+
+    print(f"300 key reply, prefix list + set(): {_best(prefixed_set, 2000):.1f} us")
+    if hasattr(data, 'set_payload'):
+        print(f"300 key reply, set_payload():       {_best(lambda: data.set_payload(PREFIX, PAYLOAD), 2000):.1f} us")
+
+
+if __name__ == '__main__':
+    bench_frames()
+    bench_rtbdata()
@@ -0,0 +1,15 @@
+"""Import the integration's pure Python modules without Home Assistant.
+
+The package __init__ sets up the integration and needs Home Assistant, so
+the modules are loaded as nbelocalconnect.<module> from a bare package.
+"""
+import os
+import sys
+import types
+
+COMPONENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'nbelocalconnect')
+
+if 'nbelocalconnect' not in sys.modules:
+    package = types.ModuleType('nbelocalconnect')
+    package.__path__ = [COMPONENT]
+    sys.modules['nbelocalconnect'] = package
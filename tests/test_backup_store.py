@@ -0,0 +1,80 @@
+"""Backup store index, deduplication and migration of old backup files."""
+import json
+import os
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from nbelocalconnect.backup_store import BackupStore  # noqa: E402
+
+SETTINGS = {'settings/boiler/temp': '65', 'settings/hot_water/temp': '50'}
+
+
+def write_legacy(directory, name, created, settings):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'name': name, 'created': created, 'serial': 'SN1', 'settings': settings}, f)
+
+
+def objects(directory):
+    return os.listdir(os.path.join(directory, 'objects'))
+
+
+def test_missing_directory_has_no_backups(tmp_path):
+    assert BackupStore(str(tmp_path / 'none')).entries() == []
+
+
+def test_add_numbers_backups_and_loads_them(tmp_path):
+    store = BackupStore(str(tmp_path))
+    first = store.add(SETTINGS, 'SN1')
+    second = store.add({'settings/boiler/temp': '70'})
+    assert first['name'].startswith('backup1_') and second['name'].startswith('backup2_')
+    assert [entry['name'] for entry in store.entries()] == [second['name'], first['name']]
+    loaded = store.load(first['name'])
+    assert loaded['settings'] == SETTINGS and loaded['serial'] == 'SN1'
+    assert store.load('none') is None
+
+
+def test_identical_settings_share_one_payload(tmp_path):
+    store = BackupStore(str(tmp_path))
+    first = store.add(SETTINGS)
+    second = store.add(dict(reversed(list(SETTINGS.items()))))
+    assert first['hash'] == second['hash']
+    assert len(objects(str(tmp_path))) == 1
+
+
+def test_delete_keeps_shared_payloads(tmp_path):
+    store = BackupStore(str(tmp_path))
+    first = store.add(SETTINGS)
+    second = store.add(SETTINGS)
+    assert store.delete(first['name'])
+    assert store.load(second['name'])['settings'] == SETTINGS
+    assert store.delete(second['name'])
+    assert objects(str(tmp_path)) == []
+    assert not store.delete(second['name'])
+
+
+def test_missing_payload_loads_as_not_found(tmp_path):
+    store = BackupStore(str(tmp_path))
+    entry = store.add(SETTINGS)
+    os.remove(store._object_path(entry['hash']))
+    assert store.load(entry['name']) is None
+
+
+def test_legacy_files_are_migrated(tmp_path):
+    directory = str(tmp_path)
+    write_legacy(directory, 'backup1_01-01-2025-10-00.json', '2025-01-01T10:00:00', SETTINGS)
+    write_legacy(directory, 'backup2_01-02-2025-10-00.json', '2025-02-01T10:00:00', SETTINGS)
+    with open(os.path.join(directory, 'broken.json'), 'w') as f:
+        f.write('{not json')
+    store = BackupStore(directory)
+    entries = store.entries()
+    assert [entry['name'] for entry in entries] == ['backup2_01-02-2025-10-00.json', 'backup1_01-01-2025-10-00.json']
+    assert len(objects(directory)) == 1
+    # The old files are moved, not deleted
+    assert sorted(os.listdir(os.path.join(directory, 'legacy'))) == [
+        'backup1_01-01-2025-10-00.json', 'backup2_01-02-2025-10-00.json', 'broken.json',
+    ]
+    assert store.load(entries[0]['name'])['settings'] == SETTINGS
+    # Numbering continues after the migrated backups
+    assert store.add(SETTINGS)['name'].startswith('backup3_')
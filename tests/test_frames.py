@@ -0,0 +1,119 @@
+"""Request frame encoding, XTEA and Reply decoding."""
+import copy
+
+import pytest
+
+from nbelocalconnect.frames import END, START, Reply, Request_frame, XTEA
+
+
+@pytest.fixture(scope="module")
+def rsa_key():
+    RSA = pytest.importorskip("Crypto.PublicKey.RSA")
+    from Crypto.Util.number import getPrime, inverse
+    # 512 bit, like the controller's key
+    e = 65537
+    while True:
+        p, q = getPrime(256), getPrime(256)
+        if (p * q).bit_length() == 512 and (p - 1) % e and (q - 1) % e:
+            return RSA.construct((p * q, e, inverse(e, (p - 1) * (q - 1)), p, q))
+
+
+def make_request(**fields):
+    request = Request_frame()
+    request.controllerid = '12345'
+    request.pincode = '1234567890'
+    for name, value in fields.items():
+        setattr(request, name, value)
+    return request
+
+
+def reply(function=1, seqno=7, status=0, payload=b'temp=65'):
+    return b'NBELocalCon_123456' + START + b'%02d%02d%d%03d' % (function, seqno, status, len(payload)) + payload + END
+
+
+def test_plain_frame_layout():
+    frame = make_request(function=1, sequencenumber=7, payload='boiler.temp').encode()
+    assert frame[:19] == b'NBELocalCon_012345 '
+    assert frame[19:20] == START
+    assert frame[20:22] == b'01'
+    assert frame[22:24] == b'07'
+    # Plain frames never carry the pin
+    assert frame[24:34] == b'0000000000'
+    assert frame[44:48] == b'pad '
+    assert frame[48:51] == b'011'
+    assert frame[51:-1] == b'boiler.temp'
+    assert frame[-1:] == END
+
+
+def test_copied_frames_share_the_template_caches():
+    template = make_request(function=4, payload='*')
+    frame = copy.copy(template)
+    frame.sequencenumber = 9
+    assert frame.encode()[22:24] == b'09'
+    assert template._prefixes and frame._prefixes is template._prefixes
+
+
+@pytest.mark.parametrize("fields", [{"function": 12}, {"payload": 'x' * 496}])
+def test_encode_rejects_invalid_frames(fields):
+    with pytest.raises(IOError):
+        make_request(**fields).encode()
+
+
+def test_rsa_frame_decrypts_to_the_plain_body(rsa_key):
+    request = make_request(function=2, sequencenumber=3, payload='boiler.temp=71', encrypted=True, public_key=rsa_key.publickey())
+    frame = request.encode()
+    assert frame[:19] == b'NBELocalCon_012345*'
+    ciphertext = frame[19:]
+    assert len(ciphertext) == 64
+    body = pow(int.from_bytes(ciphertext, 'big'), rsa_key.d, rsa_key.n).to_bytes(64, 'big')
+    assert body[:5] == START + b'0203'
+    assert body[5:15] == b'1234567890'
+    assert body[29:32] == b'014'
+    assert body[32:47] == b'boiler.temp=71' + END
+
+
+def test_xtea_test_vector():
+    cipher = XTEA(bytes(range(16)))
+    assert cipher.encrypt(bytes.fromhex('4142434445464748')).hex() == '497df3d072612cb5'
+
+
+@pytest.mark.parametrize("key, data", [(b'short', b'12345678'), (b'k' * 16, b'1234567')])
+def test_xtea_rejects_bad_sizes(key, data):
+    with pytest.raises(ValueError):
+        XTEA(key).encrypt(data)
+
+
+def test_session_frame_is_padded_to_whole_blocks():
+    request = make_request(function=2, payload='boiler.temp=71', encrypted=True)
+    request.xtea_key = XTEA(b'0123456789abcdef')
+    frame = request.encode()
+    assert frame[18:19] == b'-'
+    body = frame[19:]
+    assert len(body) >= 64 and len(body) % 8 == 0
+
+
+def test_reply_decode():
+    decoded = Reply.decode(reply(), 7)
+    assert (decoded.function, decoded.sequencenumber, decoded.status, decoded.size) == (1, 7, 0, 7)
+    assert decoded.payload == 'temp=65'
+    assert decoded.parse_payload() == {'temp': '65'}
+
+
+def test_reply_is_read_only():
+    decoded = Reply.decode(reply())
+    with pytest.raises(AttributeError):
+        decoded.payload = 'x'
+
+
+@pytest.mark.parametrize("record, seqno", [
+    (b'garbage', None),
+    (reply()[:-4], None),
+    (reply(seqno=8), 7),
+])
+def test_reply_decode_rejects_bad_frames(record, seqno):
+    with pytest.raises(IOError):
+        Reply.decode(record, seqno)
+
+
+def test_reply_tolerates_missing_end():
+    assert Reply.decode(reply()[:-1]).payload == 'temp=65'
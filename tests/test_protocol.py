@@ -0,0 +1,269 @@
+"""Retransmission timer, circuit breaker and request scheduler."""
+import asyncio
+
+import pytest
+
+from nbelocalconnect import protocol
+from nbelocalconnect.frames import Request_frame
+from nbelocalconnect.protocol import (
+    FAIRNESS_LIMIT, MAX_RETRANSMITS, PRIORITY_CONTROL, PRIORITY_POLL, PRIORITY_USER, RTO_INITIAL, RTO_MAX, RTO_MIN,
+    AsyncProxy, BoilerUnavailable, CircuitBreaker, RequestScheduler, RttEstimator,
+)
+
+
+class RecordingTransport:
+    """Stands in for the UDP transport; keeps the frames sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(data)
+
+
+def silent_proxy():
+    proxy = AsyncProxy('1234567890')
+    proxy.transport = RecordingTransport()
+    proxy.addr = ('127.0.0.1', 8483)
+    proxy.rtt.rto = 0.01
+    return proxy
+
+
+def frame(function):
+    request = Request_frame()
+    request.function = function
+    request.sequencenumber = 5
+    request.payload = 'boiler.temp' if function == 1 else 'boiler.temp=70'
+    return request
+
+
+def test_rto_starts_at_the_initial_value():
+    assert RttEstimator().rto == RTO_INITIAL
+
+
+def test_first_sample_sets_srtt_and_rttvar():
+    rtt = RttEstimator()
+    rtt.sample(0.5)
+    assert rtt.srtt == 0.5
+    assert rtt.rttvar == 0.25
+    assert rtt.rto == pytest.approx(1.5)
+
+
+def test_rto_follows_a_steady_link_down_to_the_minimum():
+    rtt = RttEstimator()
+    for _ in range(50):
+        rtt.sample(0.01)
+    assert rtt.srtt == pytest.approx(0.01)
+    assert rtt.rto == RTO_MIN
+
+
+def test_rto_is_capped():
+    rtt = RttEstimator()
+    rtt.sample(RTO_MAX * 2)
+    assert rtt.rto == RTO_MAX
+
+
+def test_jitter_raises_the_rto():
+    steady, jittery = RttEstimator(), RttEstimator()
+    for i in range(20):
+        steady.sample(0.3)
+        jittery.sample(0.1 if i % 2 else 0.5)
+    assert jittery.rto > steady.rto
+
+
+def test_unanswered_read_is_retransmitted_with_the_same_frame():
+    proxy = silent_proxy()
+    with pytest.raises(TimeoutError):
+        asyncio.run(proxy._async_send(frame(1), proxy.addr, 1))
+    sent = proxy.transport.sent
+    assert len(sent) == MAX_RETRANSMITS + 1
+    assert len(set(sent)) == 1
+    assert proxy.retransmits == MAX_RETRANSMITS and proxy.losses == 1
+    assert not proxy._pending
+
+
+def test_unanswered_write_is_sent_once(monkeypatch):
+    monkeypatch.setattr(protocol, 'WRITE_TIMEOUT', 0.05)
+    proxy = silent_proxy()
+    with pytest.raises(TimeoutError):
+        asyncio.run(proxy._async_send(frame(2), proxy.addr, 0.01))
+    assert len(proxy.transport.sent) == 1
+    assert proxy.retransmits == 0
+
+
+def open_breaker(threshold=3):
+    breaker = CircuitBreaker(threshold=threshold, min_backoff=10, max_backoff=40)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_threshold_timeouts():
+    breaker = CircuitBreaker(threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_closed and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.opened_at is not None
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.is_closed
+
+
+def test_one_probe_is_let_through_after_the_backoff():
+    breaker = open_breaker()
+    breaker.next_probe = 0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only the probe - everything else is still refused
+    assert not breaker.allow()
+
+
+def test_answered_probe_closes_the_breaker():
+    breaker = open_breaker()
+    breaker.next_probe = 0
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.is_closed and breaker.backoff == 10
+
+
+def test_timed_out_probe_doubles_the_backoff_up_to_the_maximum():
+    breaker = open_breaker()
+    for backoff in (20, 40, 40):
+        breaker.next_probe = 0
+        breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.backoff == backoff
+
+
+def test_aborted_probe_reopens_with_the_same_backoff():
+    breaker = open_breaker()
+    breaker.next_probe = 0
+    breaker.allow()
+    breaker.abort_probe()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.backoff == 10
+    assert 9 <= breaker.seconds_to_probe() <= 10
+
+
+def test_open_breaker_refuses_requests_without_sending():
+    proxy = silent_proxy()
+    proxy.breaker = open_breaker()
+    with pytest.raises(BoilerUnavailable):
+        asyncio.run(proxy._make_request(1, 'boiler.temp'))
+    assert not proxy.transport.sent
+
+
+def test_malformed_probe_reply_does_not_leave_the_breaker_half_open():
+    proxy = silent_proxy()
+    proxy.breaker = open_breaker()
+    proxy.breaker.next_probe = 0
+
+    async def garbled_send(request, addr, timeout):
+        raise IOError("Invalid response header")
+
+    proxy._async_send = garbled_send
+    with pytest.raises(IOError, match="Invalid response header"):
+        asyncio.run(proxy._make_request(1, 'boiler.temp'))
+    assert proxy.breaker.state == CircuitBreaker.OPEN
+
+
+async def waiter(scheduler, priority, granted, name):
+    await scheduler.acquire([priority])
+    granted.append(name)
+
+
+async def queue(scheduler, granted, *waiters):
+    """Queue (priority, name) waiters in order; returns their tasks."""
+    tasks = []
+    for priority, name in waiters:
+        tasks.append(asyncio.ensure_future(waiter(scheduler, priority, granted, name)))
+        await asyncio.sleep(0)
+    return tasks
+
+
+def test_free_slots_are_granted_at_once():
+    async def run():
+        scheduler = RequestScheduler(2)
+        await scheduler.acquire([PRIORITY_POLL])
+        await scheduler.acquire([PRIORITY_POLL])
+        assert scheduler.active == 2 and scheduler.depth == 0
+    asyncio.run(run())
+
+
+def test_released_slot_goes_to_the_highest_priority():
+    async def run():
+        scheduler = RequestScheduler(1)
+        await scheduler.acquire([PRIORITY_POLL])
+        granted = []
+        await queue(scheduler, granted, (PRIORITY_POLL, 'poll'), (PRIORITY_USER, 'user'))
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert granted == ['user']
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert granted == ['user', 'poll']
+    asyncio.run(run())
+
+
+def test_control_requests_use_the_reserved_slot():
+    async def run():
+        scheduler = RequestScheduler(1)
+        await scheduler.acquire([PRIORITY_POLL])
+        granted = []
+        await queue(scheduler, granted, (PRIORITY_POLL, 'poll'), (PRIORITY_CONTROL, 'write'))
+        assert granted == ['write'] and scheduler.active == 2
+    asyncio.run(run())
+
+
+def test_passed_over_waiter_goes_next_after_the_fairness_limit():
+    async def run():
+        scheduler = RequestScheduler(1)
+        await scheduler.acquire([PRIORITY_POLL])
+        granted = []
+        users = [(PRIORITY_USER, f'user{i}') for i in range(FAIRNESS_LIMIT + 1)]
+        await queue(scheduler, granted, (PRIORITY_POLL, 'poll'), *users)
+        for _ in range(FAIRNESS_LIMIT + 1):
+            scheduler.release()
+            await asyncio.sleep(0)
+        assert granted[:FAIRNESS_LIMIT] == [name for _, name in users[:FAIRNESS_LIMIT]]
+        assert granted[FAIRNESS_LIMIT] == 'poll'
+    asyncio.run(run())
+
+
+def test_overdue_waiter_does_not_block_the_control_slot():
+    async def run():
+        scheduler = RequestScheduler(1)
+        await scheduler.acquire([PRIORITY_POLL])
+        granted = []
+        await queue(scheduler, granted, (PRIORITY_POLL, 'poll'))
+        scheduler._passed = FAIRNESS_LIMIT
+        await queue(scheduler, granted, (PRIORITY_CONTROL, 'write'))
+        assert granted == ['write']
+        scheduler.release()
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert granted == ['write', 'poll']
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        scheduler = RequestScheduler(1)
+        await scheduler.acquire([PRIORITY_POLL])
+        granted = []
+        cancelled, waiting = await queue(scheduler, granted, (PRIORITY_USER, 'cancelled'), (PRIORITY_POLL, 'poll'))
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert granted == ['poll'] and scheduler.depth == 0 and scheduler.active == 1
+    asyncio.run(run())
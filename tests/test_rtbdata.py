@@ -0,0 +1,139 @@
+"""RTBData storage and typed reads."""
+import math
+
+import pytest
+
+from nbelocalconnect.rtbdata import RTBData
+
+
+def test_set_keeps_keys_missing_from_a_later_poll():
+    data = RTBData(['operating_data/boiler_temp=61.2', 'operating_data/state=5'])
+    data.set(['operating_data/state=14', 'keyless'])
+    assert data.get('operating_data/boiler_temp') == '61.2'
+    assert data.get('operating_data/state') == '14'
+    assert data.get('keyless') is None
+
+
+def test_set_payload_prefixes_the_reply_keys():
+    data = RTBData([])
+    assert data.set_payload('settings/boiler/', 'temp=65;diff_over=5;no_value') == 2
+    assert data.get_all() == {'settings/boiler/temp': '65', 'settings/boiler/diff_over': '5'}
+
+
+def test_set_payload_matches_set():
+    payload = 'boiler_temp=61.2;state=5;empty='
+    by_set = RTBData(['operating_data/' + item for item in payload.split(';')])
+    by_payload = RTBData([])
+    by_payload.set_payload('operating_data/', payload)
+    assert by_payload.get_all() == by_set.get_all()
+
+
+@pytest.mark.parametrize("raw, number, integer", [
+    ('65', 65.0, 65),
+    ('65.7', 65.7, 65),
+    ('-3.5', -3.5, -3),
+    ('', None, None),
+    ('off', None, None),
+    ('nan', math.nan, None),
+    ('inf', float('inf'), None),
+])
+def test_typed_reads(raw, number, integer):
+    data = RTBData([f'settings/boiler/temp={raw}'])
+    value = data.get_float('settings/boiler/temp')
+    assert math.isnan(value) if raw == 'nan' else value == number
+    assert data.get_int('settings/boiler/temp') == integer
+    assert data.get_int('settings/boiler/temp', 0) == (0 if integer is None else integer)
+
+
+def test_missing_key_gives_the_default():
+    data = RTBData([])
+    assert data.get_float('operating_data/none', 1.5) == 1.5
+    assert data.get_int('operating_data/none', 7) == 7
+    assert data.get_array('operating_data/none') is None
+
+
+def test_get_array():
+    data = RTBData(['consumption_data/total_hours=0.1,0.2,,1.5', 'consumption_data/counter=x,y'])
+    assert data.get_array('consumption_data/total_hours') == (0.1, 0.2, 1.5)
+    assert data.get_array('consumption_data/counter') is None
+
+
+def test_parsed_values_follow_raw_changes():
+    data = RTBData(['settings/boiler/temp=65'])
+    assert data.get_int('settings/boiler/temp') == 65
+    data.set(['settings/boiler/temp=70'])
+    assert data.get_int('settings/boiler/temp') == 70
+    data.set_payload('settings/boiler/', 'temp=bad')
+    assert data.get_float('settings/boiler/temp') is None
+    data.set_payload('settings/boiler/', 'temp=72')
+    assert data.get_float('settings/boiler/temp') == 72.0
+
+
+def test_parsed_value_is_cached():
+    data = RTBData(['settings/boiler/temp=65'])
+    data.get_float('settings/boiler/temp')
+    data.data['settings/boiler/temp'] = '99'
+    # Only set()/set_payload() drop the cached value
+    assert data.get_float('settings/boiler/temp') == 65.0
+
+
+def test_set_returns_the_changed_keys():
+    data = RTBData(['settings/boiler/temp=65', 'settings/boiler/diff_over=5'])
+    assert data.set(['settings/boiler/temp=65', 'settings/boiler/diff_over=6']) == {'settings/boiler/diff_over'}
+    assert data.set(['settings/boiler/temp=65']) == set()
+
+
+def test_take_changed_collects_until_taken():
+    data = RTBData([])
+    data.set_payload('operating_data/', 'boiler_temp=61.2;state=5')
+    data.set(['settings/boiler/temp=65'])
+    assert data.take_changed() == {'operating_data/boiler_temp', 'operating_data/state', 'settings/boiler/temp'}
+    data.set_payload('operating_data/', 'boiler_temp=61.4;state=5')
+    assert data.take_changed() == {'operating_data/boiler_temp'}
+    assert data.take_changed() == set()
+
+
+def test_generations_only_move_on_changes():
+    data = RTBData([])
+    data.set_payload('operating_data/', 'boiler_temp=61.2;state=5')
+    assert data.generation == 1
+    data.set_payload('operating_data/', 'boiler_temp=61.2;state=5')
+    assert data.generation == 1
+    data.set_payload('operating_data/', 'boiler_temp=61.4;state=5')
+    assert data.generation == 2
+    assert data.key_generation('operating_data/boiler_temp') == 2
+    assert data.key_generation('operating_data/state') == 1
+    assert data.key_generation('operating_data/none') == 0
+
+
+@pytest.fixture
+def indexed():
+    data = RTBData(['operating_data/state=5', 'settings/boiler/temp=65', 'settings/boiler/diff_over=5'])
+    data.set_payload('settings/hot_water/', 'temp=50')
+    return data
+
+
+def test_index_endpoints_and_categories(indexed):
+    assert indexed.get_endpoints() == ['operating_data', 'settings']
+    assert indexed.get_categories('settings') == ['boiler', 'hot_water']
+    assert indexed.get_categories('operating_data') == ['']
+    assert indexed.get_categories('none') == []
+
+
+def test_index_keys(indexed):
+    assert indexed.get_keys('settings', 'boiler') == ['settings/boiler/temp', 'settings/boiler/diff_over']
+    assert indexed.get_keys('settings') == ['settings/boiler/temp', 'settings/boiler/diff_over', 'settings/hot_water/temp']
+    assert indexed.get_keys('settings', 'none') == []
+    assert indexed.get_keys('none') == []
+
+
+def test_changed_values_are_indexed_once(indexed):
+    indexed.set(['settings/boiler/temp=70'])
+    indexed.set_payload('settings/boiler/', 'temp=71')
+    assert indexed.get_keys('settings', 'boiler') == ['settings/boiler/temp', 'settings/boiler/diff_over']
+
+
+@pytest.mark.parametrize("prefix", ['settings/', 'settings/boiler/', 'settings/bo', 'operating_data/', 'x/'])
+def test_prefix_queries_match_a_full_scan(indexed, prefix):
+    scan = {key: value for key, value in indexed.get_all().items() if key.startswith(prefix)}
+    assert indexed.get_all_starting_with(prefix) == scan